@@ -1,4 +1,4 @@
-import requests
+from app.client.http import get_session
 import json
 from app.config import ATLANTIC_API_KEY, ATLANTIC_BASE_URL
 
@@ -11,7 +11,7 @@ def get_deposit_methods():
     headers = {'Content-Type': 'application/x-www-form-urlencoded'}
 
     try:
-        response = requests.post(url, data=payload, headers=headers, timeout=30)
+        response = get_session().post(url, data=payload, headers=headers, timeout=30)
         data = response.json()
 
         if data.get("status") is True and data.get("data"):
@@ -37,7 +37,7 @@ def create_deposit_request(amount: int, metode_kode: str, metode_type: str, reff
     headers = {'Content-Type': 'application/x-www-form-urlencoded'}
     
     try:
-        response = requests.post(url, data=payload, headers=headers, timeout=30)
+        response = get_session().post(url, data=payload, headers=headers, timeout=30)
         data = response.json()
         if data.get("status") is True:
             return data.get("data")
@@ -55,7 +55,7 @@ def request_instant_deposit(deposit_id: str):
     headers = {'Content-Type': 'application/x-www-form-urlencoded'}
     
     try:
-        response = requests.post(url, data=payload, headers=headers, timeout=30)
+        response = get_session().post(url, data=payload, headers=headers, timeout=30)
         data = response.json()
         if data.get("status") is True:
             return data.get("data")
@@ -76,7 +76,7 @@ def check_deposit_status(deposit_id: str):
     headers = {'Content-Type': 'application/x-www-form-urlencoded'}
     
     try:
-        response = requests.post(url, data=payload, headers=headers, timeout=30)
+        response = get_session().post(url, data=payload, headers=headers, timeout=30)
         data = response.json()
         
         # Berdasarkan dokumentasi, kita langsung mengembalikan objek 'data' jika statusnya True
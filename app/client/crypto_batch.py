@@ -0,0 +1,85 @@
+import os
+import asyncio
+from app.client.http import get_async_client
+
+# Batching untuk crypto service (encryptsign / decrypt).
+# Permintaan yang datang bersamaan dalam jendela CRYPTO_BATCH_WINDOW_MS
+# dikumpulkan lalu dikirim sebagai satu panggilan multi-item.
+#
+# Format endpoint batch:
+#   POST <url>  {"items": [<body single request>, ...]}
+#   200         {"results": [<response single request> | {"error": "..."}, ...]}
+# Urutan "results" harus sama dengan urutan "items".
+CRYPTO_BATCH_ENABLED = os.getenv("CRYPTO_BATCH_ENABLED", "false").lower() == "true"
+CRYPTO_BATCH_WINDOW_MS = float(os.getenv("CRYPTO_BATCH_WINDOW_MS", "5"))
+CRYPTO_BATCH_MAX_SIZE = int(os.getenv("CRYPTO_BATCH_MAX_SIZE", "32"))
+
+class CryptoBatcher:
+    def __init__(self, url: str, window_ms: float = CRYPTO_BATCH_WINDOW_MS, max_size: int = CRYPTO_BATCH_MAX_SIZE):
+        self.url = url
+        self.window = window_ms / 1000
+        self.max_size = max_size
+        # Dipisah per api_key karena api_key dikirim lewat header.
+        self._pending = {}  # api_key -> [(item, future), ...]
+        self._timers = {}   # api_key -> TimerHandle
+        # Referensi task _send yang sedang berjalan; event loop hanya memegangnya secara weak
+        self._tasks = set()
+        self.stats = {"batches": 0, "items": 0}
+
+    async def submit(self, api_key: str, item: dict) -> dict:
+        """Masukkan satu item ke batch berikutnya dan tunggu hasilnya sendiri."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        bucket = self._pending.setdefault(api_key, [])
+        bucket.append((item, future))
+
+        if len(bucket) >= self.max_size:
+            self._flush(api_key)
+        elif len(bucket) == 1:
+            self._timers[api_key] = loop.call_later(self.window, self._flush, api_key)
+
+        return await future
+
+    def _flush(self, api_key: str):
+        timer = self._timers.pop(api_key, None)
+        if timer:
+            timer.cancel()
+        batch = self._pending.pop(api_key, None)
+        if batch:
+            task = asyncio.ensure_future(self._send(api_key, batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, api_key: str, batch: list):
+        headers = {
+            "Content-Type": "application/json",
+            "x-api-key": api_key,
+        }
+        try:
+            response = await get_async_client().post(
+                self.url,
+                json={"items": [item for item, _ in batch]},
+                headers=headers,
+                timeout=30,
+            )
+            if response.status_code != 200:
+                raise Exception(f"Batch request failed: {response.text}")
+            results = response.json().get("results")
+            if not isinstance(results, list) or len(results) != len(batch):
+                raise Exception("Batch response does not match request size")
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.stats["batches"] += 1
+        self.stats["items"] += len(batch)
+
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, dict) and result.get("error"):
+                future.set_exception(Exception(result["error"]))
+            else:
+                future.set_result(result)
@@ -1,20 +1,25 @@
-import os, hashlib, requests, brotli, zlib, base64
+import os, hashlib, brotli, zlib, base64
 from random import randint
 from datetime import datetime, timezone, timedelta
 from Crypto.Cipher import AES
 from Crypto.Util.Padding import pad
 from dataclasses import dataclass
 from typing import Union
+from app.client.http import get_session, get_async_client
+from app.client.crypto_batch import CryptoBatcher, CRYPTO_BATCH_ENABLED
 
 API_KEY = os.getenv("API_KEY")
 
-BASE_CRYPTO_URL = "https://crypto.mashu.lol/api/870"
+# Bisa diarahkan ke crypto_stub_server.py untuk benchmark offline.
+BASE_CRYPTO_URL = os.getenv("BASE_CRYPTO_URL", "https://crypto.mashu.lol/api/870")
 
 XDATA_DECRYPT_URL = f"{BASE_CRYPTO_URL}/decrypt"
 XDATA_ENCRYPT_SIGN_URL = f"{BASE_CRYPTO_URL}/encryptsign"
 PAYMENT_SIGN_URL = f"{BASE_CRYPTO_URL}/sign-payment"
 BOUNTY_SIGN_URL = f"{BASE_CRYPTO_URL}/sign-bounty"
 AX_SIGN_URL = f"{BASE_CRYPTO_URL}/sign-ax"
+XDATA_DECRYPT_BATCH_URL = f"{XDATA_DECRYPT_URL}/batch"
+XDATA_ENCRYPT_SIGN_BATCH_URL = f"{XDATA_ENCRYPT_SIGN_URL}/batch"
 
 AES_KEY_ASCII = os.getenv("AES_KEY_ASCII")
 BLOCK = AES.block_size
@@ -134,7 +139,7 @@ def ax_api_signature(
         "contact_type": contact_type
     }
     
-    response = requests.request("POST", AX_SIGN_URL, json=request_body, headers=headers, timeout=30)
+    response = get_session().request("POST", AX_SIGN_URL, json=request_body, headers=headers, timeout=30)
     if response.status_code == 200:
         return response.json().get("ax_signature")
     else:
@@ -159,7 +164,7 @@ def encryptsign_xdata(
         "body": payload
     }
 
-    response = requests.request("POST", XDATA_ENCRYPT_SIGN_URL, json=request_body, headers=headers, timeout=30)
+    response = get_session().request("POST", XDATA_ENCRYPT_SIGN_URL, json=request_body, headers=headers, timeout=30)
     
     if response.status_code == 200:
         return response.json()
@@ -178,7 +183,7 @@ def decrypt_xdata(
         "x-api-key": api_key,
     }
     
-    response = requests.request("POST", XDATA_DECRYPT_URL, json=encrypted_payload, headers=headers, timeout=30)
+    response = get_session().request("POST", XDATA_DECRYPT_URL, json=encrypted_payload, headers=headers, timeout=30)
     
     if response.status_code == 200:
         return response.json().get("plaintext")
@@ -208,7 +213,7 @@ def get_x_signature_payment(
         "payment_for": payment_for
     }
     
-    response = requests.request("POST", PAYMENT_SIGN_URL, json=request_body, headers=headers, timeout=30)
+    response = get_session().request("POST", PAYMENT_SIGN_URL, json=request_body, headers=headers, timeout=30)
     
     if response.status_code == 200:
         return response.json().get("x_signature")
@@ -234,7 +239,7 @@ def get_x_signature_bounty(
         "token_payment": token_payment
     }
     
-    response = requests.request("POST", BOUNTY_SIGN_URL, json=request_body, headers=headers, timeout=30)
+    response = get_session().request("POST", BOUNTY_SIGN_URL, json=request_body, headers=headers, timeout=30)
     if response.status_code == 200:
         return response.json().get("x_signature")
     else:
@@ -243,3 +248,116 @@ def get_x_signature_bounty(
 def ax_device_id() -> str:
     android_id = load_ax_fp() # Actually just b*llsh*tting
     return hashlib.md5(android_id.encode("utf-8")).hexdigest()
+
+
+# --- Versi async (dipakai handler bot agar tidak memblokir event loop) ---
+
+encrypt_batcher = CryptoBatcher(XDATA_ENCRYPT_SIGN_BATCH_URL)
+decrypt_batcher = CryptoBatcher(XDATA_DECRYPT_BATCH_URL)
+
+async def ax_api_signature_async(
+        api_key: str,
+        ts_for_sign: str,
+        contact: str,
+        code: str,
+        contact_type: str
+    ) -> str:
+    headers = {
+        "Content-Type": "application/json",
+        "x-api-key": api_key,
+    }
+    
+    request_body = {
+        "ts_for_sign": ts_for_sign,
+        "contact": contact,
+        "code": code,
+        "contact_type": contact_type
+    }
+    
+    response = await get_async_client().post(AX_SIGN_URL, json=request_body, headers=headers, timeout=30)
+    if response.status_code == 200:
+        return response.json().get("ax_signature")
+    else:
+        raise Exception(f"Signature generation failed: {response.text}")
+
+async def encryptsign_xdata_async(
+        api_key: str,
+        method: str,
+        path: str,
+        id_token: str,
+        payload: dict
+    ) -> dict:
+    headers = {
+        "Content-Type": "application/json",
+        "x-api-key": api_key,
+    }
+    
+    request_body = {
+        "id_token": id_token,
+        "method": method,
+        "path": path,
+        "body": payload
+    }
+
+    if CRYPTO_BATCH_ENABLED:
+        return await encrypt_batcher.submit(api_key, request_body)
+
+    response = await get_async_client().post(XDATA_ENCRYPT_SIGN_URL, json=request_body, headers=headers, timeout=30)
+    
+    if response.status_code == 200:
+        return response.json()
+    else:
+        raise Exception(f"Encryption failed: {response.text}")
+
+async def decrypt_xdata_async(
+    api_key: str,
+    encrypted_payload: dict
+    ) -> dict:
+    if not isinstance(encrypted_payload, dict) or "xdata" not in encrypted_payload or "xtime" not in encrypted_payload:
+        raise ValueError("Invalid encrypted data format. Expected a dictionary with 'xdata' and 'xtime' keys.")
+    
+    headers = {
+        "Content-Type": "application/json",
+        "x-api-key": api_key,
+    }
+    
+    if CRYPTO_BATCH_ENABLED:
+        result = await decrypt_batcher.submit(api_key, encrypted_payload)
+        return result.get("plaintext")
+
+    response = await get_async_client().post(XDATA_DECRYPT_URL, json=encrypted_payload, headers=headers, timeout=30)
+    
+    if response.status_code == 200:
+        return response.json().get("plaintext")
+    else:
+        raise Exception(f"Decryption failed: {response.text}")
+
+async def get_x_signature_payment_async(
+        api_key: str,
+        access_token: str,
+        sig_time_sec: int,
+        package_code: str,
+        token_payment: str,
+        payment_method: str,
+        payment_for: str = "BUY_PACKAGE"
+    ) -> str:
+    headers = {
+        "Content-Type": "application/json",
+        "x-api-key": api_key,
+    }
+    
+    request_body = {
+        "access_token": access_token,
+        "sig_time_sec": sig_time_sec,
+        "package_code": package_code,
+        "token_payment": token_payment,
+        "payment_method": payment_method,
+        "payment_for": payment_for
+    }
+    
+    response = await get_async_client().post(PAYMENT_SIGN_URL, json=request_body, headers=headers, timeout=30)
+    
+    if response.status_code == 200:
+        return response.json().get("x_signature")
+    else:
+        raise Exception(f"Signature generation failed: {response.text}")
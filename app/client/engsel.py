@@ -2,6 +2,12 @@ import os, json, uuid, requests, time
 from datetime import datetime, timezone, timedelta
 from typing import Union
 from app.client.encrypt import encryptsign_xdata, java_like_timestamp, ts_gmt7_without_colon, ax_api_signature, decrypt_xdata, API_KEY, get_x_signature_payment, build_encrypted_field, load_ax_fp, ax_device_id
+from app.client.encrypt import encryptsign_xdata_async, decrypt_xdata_async, ax_api_signature_async
+from app.client.http import get_session, get_async_client
+from app.service.package_catalog import PackageCatalogInstance, PackageDetailCacheInstance, FAMILY_CACHE_TTL
+from app.util import subscriber_segment
+from app.client.single_flight import api_single_flight, request_key
+import httpx
 
 BASE_API_URL = os.getenv("BASE_API_URL")
 BASE_CIAM_URL = os.getenv("BASE_CIAM_URL")
@@ -21,25 +27,19 @@ def validate_contact(contact: str) -> bool:
         return False
     return True
 
-def get_otp(contact: str) -> str:
-    # Contact example: "6287896089467"
-    if not validate_contact(contact):
-        return None
-    
-    url = GET_OTP_URL
-
-    querystring = {
+def _otp_querystring(contact: str) -> dict:
+    return {
         "contact": contact,
         "contactType": "SMS",
         "alternateContact": "false"
     }
-    
+
+def _otp_headers() -> dict:
     now = datetime.now(timezone(timedelta(hours=7)))
     ax_request_at = java_like_timestamp(now)  # format: "2023-10-20T12:34:56.78+07:00"
     ax_request_id = str(uuid.uuid4())
 
-    payload = ""
-    headers = {
+    return {
         "Accept-Encoding": "gzip, deflate, br",
         "Authorization": f"Basic {BASIC_AUTH}",
         "Ax-Device-Id": AX_DEVICE_ID,
@@ -54,9 +54,19 @@ def get_otp(contact: str) -> str:
         "User-Agent": UA,
     }
 
+def get_otp(contact: str) -> str:
+    # Contact example: "6287896089467"
+    if not validate_contact(contact):
+        return None
+    
+    url = GET_OTP_URL
+    querystring = _otp_querystring(contact)
+    payload = ""
+    headers = _otp_headers()
+
     print("Requesting OTP...")
     try:
-        response = requests.request("GET", url, data=payload, headers=headers, params=querystring, timeout=30)
+        response = get_session().request("GET", url, data=payload, headers=headers, params=querystring, timeout=30)
         print("response body", response.text)
         json_body = json.loads(response.text)
     
@@ -69,13 +79,34 @@ def get_otp(contact: str) -> str:
         print(f"Error requesting OTP: {e}")
         return None
     
-def submit_otp(api_key: str, contact: str, code: str):
+def _submit_otp_headers(signature: str, ts_header: str) -> dict:
+    return {
+        "Accept-Encoding": "gzip, deflate, br",
+        "Authorization": f"Basic {BASIC_AUTH}",
+        "Ax-Api-Signature": signature,
+        "Ax-Device-Id": AX_DEVICE_ID,
+        "Ax-Fingerprint": AX_FP,
+        "Ax-Request-At": ts_header,
+        "Ax-Request-Device": "samsung",
+        "Ax-Request-Device-Model": "SM-N935F",
+        "Ax-Request-Id": str(uuid.uuid4()),
+        "Ax-Substype": "PREPAID",
+        "Content-Type": "application/x-www-form-urlencoded",
+        "User-Agent": UA,
+    }
+
+def _validate_otp_input(contact: str, code: str) -> bool:
     if not validate_contact(contact):
         print("Invalid number")
-        return None
+        return False
     
     if not code or len(code) != 6:
         print("Invalid OTP code format")
+        return False
+    return True
+
+def submit_otp(api_key: str, contact: str, code: str):
+    if not _validate_otp_input(contact, code):
         return None
     
     url = SUBMIT_OTP_URL
@@ -86,24 +117,10 @@ def submit_otp(api_key: str, contact: str, code: str):
     signature = ax_api_signature(api_key, ts_for_sign, contact, code, "SMS")
 
     payload = f"contactType=SMS&code={code}&grant_type=password&contact={contact}&scope=openid"
-
-    headers = {
-        "Accept-Encoding": "gzip, deflate, br",
-        "Authorization": f"Basic {BASIC_AUTH}",
-        "Ax-Api-Signature": signature,
-        "Ax-Device-Id": AX_DEVICE_ID,
-        "Ax-Fingerprint": AX_FP,
-        "Ax-Request-At": ts_header,
-        "Ax-Request-Device": "samsung",
-        "Ax-Request-Device-Model": "SM-N935F",
-        "Ax-Request-Id": str(uuid.uuid4()),
-        "Ax-Substype": "PREPAID",
-        "Content-Type": "application/x-www-form-urlencoded",
-        "User-Agent": UA,
-    }
+    headers = _submit_otp_headers(signature, ts_header)
 
     try:
-        response = requests.post(url, data=payload, headers=headers, timeout=30)
+        response = get_session().post(url, data=payload, headers=headers, timeout=30)
         json_body = json.loads(response.text)
         
         if "error" in json_body:
@@ -132,14 +149,12 @@ def load_tokens(filename: str = "tokens.json") -> dict:
         print(f"File {filename} not found. Returning empty tokens.")
         return {}
 
-def get_new_token(refresh_token: str) -> str:
-    url = SUBMIT_OTP_URL
-
+def _refresh_token_headers() -> dict:
     now = datetime.now(timezone(timedelta(hours=7)))  # GMT+7
     ax_request_at = now.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "+0700"
     ax_request_id = str(uuid.uuid4())
 
-    headers = {
+    return {
         "Host": BASE_CIAM_URL.replace("https://", ""),
         "ax-request-at": ax_request_at,
         "ax-device-id": AX_DEVICE_ID,
@@ -153,12 +168,16 @@ def get_new_token(refresh_token: str) -> str:
         "content-type": "application/x-www-form-urlencoded"
     }
 
+def get_new_token(refresh_token: str) -> str:
+    url = SUBMIT_OTP_URL
+    headers = _refresh_token_headers()
+
     data = {
         "grant_type": "refresh_token",
         "refresh_token": refresh_token
     }
 
-    resp = requests.post(url, headers=headers, data=data, timeout=30)
+    resp = get_session().post(url, headers=headers, data=data, timeout=30)
     if resp.status_code == 400:
         if resp.json().get("error_description") == "Session not active":
             print("Refresh token expired. Pleas remove and re-add the account.")
@@ -166,8 +185,9 @@ def get_new_token(refresh_token: str) -> str:
         
     resp.raise_for_status()
 
-    body = resp.json()
-    
+    return _parse_new_token(resp.json())
+
+def _parse_new_token(body: dict) -> dict:
     if "id_token" not in body:
         raise ValueError("ID token not found in response")
     if "error" in body:
@@ -175,21 +195,8 @@ def get_new_token(refresh_token: str) -> str:
     
     return body
 
-def send_api_request(
-    api_key: str,
-    path: str,
-    payload_dict: dict,
-    id_token: str,
-    method: str = "POST",
-):
-    encrypted_payload = encryptsign_xdata(
-        api_key=api_key,
-        method=method,
-        path=path,
-        id_token=id_token,
-        payload=payload_dict
-    )
-    
+def build_api_request(path: str, encrypted_payload: dict, id_token: str):
+    """Menyusun url, header dan body untuk XL API dari hasil encryptsign."""
     xtime = int(encrypted_payload["encrypted_body"]["xtime"])
     
     now = datetime.now(timezone.utc).astimezone()
@@ -211,11 +218,68 @@ def send_api_request(
         "x-request-at": java_like_timestamp(now),
         "x-version-app": "8.7.0",
     }
-    
-    
 
     url = f"{BASE_API_URL}/{path}"
-    resp = requests.post(url, headers=headers, data=json.dumps(body), timeout=30)
+    return url, headers, json.dumps(body)
+
+def build_settlement_request(path: str, encrypted_payload: dict, id_token: str, x_sig: str):
+    """
+    Sama seperti build_api_request, tetapi untuk endpoint settlement:
+    x-signature berasal dari sign-payment dan x-request-at mengikuti xtime.
+    """
+    xtime = int(encrypted_payload["encrypted_body"]["xtime"])
+    sig_time_sec = (xtime // 1000)
+    x_requested_at = datetime.fromtimestamp(sig_time_sec, tz=timezone.utc).astimezone()
+
+    body = encrypted_payload["encrypted_body"]
+
+    headers = {
+        "host": BASE_API_URL.replace("https://", ""),
+        "content-type": "application/json; charset=utf-8",
+        "user-agent": UA,
+        "x-api-key": API_KEY,
+        "authorization": f"Bearer {id_token}",
+        "x-hv": "v3",
+        "x-signature-time": str(sig_time_sec),
+        "x-signature": x_sig,
+        "x-request-id": str(uuid.uuid4()),
+        "x-request-at": java_like_timestamp(x_requested_at),
+        "x-version-app": "8.7.0",
+    }
+
+    url = f"{BASE_API_URL}/{path}"
+    return url, headers, json.dumps(body)
+
+def send_api_request(
+    api_key: str,
+    path: str,
+    payload_dict: dict,
+    id_token: str,
+    method: str = "POST",
+):
+    # Request baca identik yang berjalan bersamaan cukup dikirim sekali
+    key = request_key(path, payload_dict, id_token)
+    if key is None:
+        return _send_api_request(api_key, path, payload_dict, id_token, method)
+    return api_single_flight.do(key, lambda: _send_api_request(api_key, path, payload_dict, id_token, method))
+
+def _send_api_request(
+    api_key: str,
+    path: str,
+    payload_dict: dict,
+    id_token: str,
+    method: str = "POST",
+):
+    encrypted_payload = encryptsign_xdata(
+        api_key=api_key,
+        method=method,
+        path=path,
+        id_token=id_token,
+        payload=payload_dict
+    )
+    
+    url, headers, body = build_api_request(path, encrypted_payload, id_token)
+    resp = get_session().post(url, headers=headers, data=body, timeout=30)
     
     # print(f"Headers: {json.dumps(headers, indent=2)}")
     # print(f"Response body: {resp.text}")
@@ -271,7 +335,19 @@ def get_family(
     print("Fetching package family...")
     path = "api/v8/xl-stores/options/list"
     id_token = tokens.get("id_token")
-    payload_dict = {
+    payload_dict = family_payload(family_code, is_enterprise, migration_type)
+    
+    res = send_api_request(api_key, path, payload_dict, id_token, "POST")
+    if res.get("status") != "SUCCESS":
+        print(f"Failed to get family {family_code}")
+        print(json.dumps(res, indent=2))
+        input("Press Enter to continue...")
+        return None
+    # print(json.dumps(res, indent=2))
+    return res["data"]
+
+def family_payload(family_code: str, is_enterprise: bool, migration_type: str) -> dict:
+    return {
         "is_show_tagging_tab": True,
         "is_dedicated_event": True,
         "is_transaction_routine": False,
@@ -284,15 +360,6 @@ def get_family(
         "is_migration": False,
         "lang": "en"
     }
-    
-    res = send_api_request(api_key, path, payload_dict, id_token, "POST")
-    if res.get("status") != "SUCCESS":
-        print(f"Failed to get family {family_code}")
-        print(json.dumps(res, indent=2))
-        input("Press Enter to continue...")
-        return None
-    # print(json.dumps(res, indent=2))
-    return res["data"]
 
 def get_families(api_key: str, tokens: dict, package_category_code: str) -> dict:
     print("Fetching families...")
@@ -324,9 +391,32 @@ def get_package(
     package_family_code: str = "",
     package_variant_code: str = ""
     ) -> dict:
+    cache_key = PackageDetailCacheInstance.make_key(tokens, package_option_code, is_enterprise)
+    cached = PackageDetailCacheInstance.get(cache_key)
+    if cached:
+        return cached
+
     path = "api/v8/xl-stores/options/detail"
+    raw_payload = package_payload(package_option_code, is_enterprise, package_family_code, package_variant_code)
     
-    raw_payload = {
+    print("Fetching package details...")
+    res = send_api_request(api_key, path, raw_payload, tokens["id_token"], "POST")
+    
+    if "data" not in res:
+        print(json.dumps(res, indent=2))
+        print("Error getting package:", res.get("error", "Unknown error"))
+        return None
+        
+    PackageDetailCacheInstance.put(cache_key, res["data"])
+    return res["data"]
+
+def package_payload(
+    package_option_code: str,
+    is_enterprise: bool,
+    package_family_code: str = "",
+    package_variant_code: str = ""
+) -> dict:
+    return {
         "is_transaction_routine": False,
         "migration_type": "NONE",
         "package_family_code": package_family_code,
@@ -340,16 +430,6 @@ def get_package(
         "is_upsell_pdp": False,
         "package_variant_code": package_variant_code
     }
-    
-    print("Fetching package details...")
-    res = send_api_request(api_key, path, raw_payload, tokens["id_token"], "POST")
-    
-    if "data" not in res:
-        print(json.dumps(res, indent=2))
-        print("Error getting package:", res.get("error", "Unknown error"))
-        return None
-        
-    return res["data"]
 
 def get_addons(api_key: str, tokens: dict, package_option_code: str) -> dict:
     path = "api/v8/xl-stores/options/addons-pinky-box"
@@ -443,7 +523,7 @@ def send_payment_request(
     }
     
     url = f"{BASE_API_URL}/{path}"
-    resp = requests.post(url, headers=headers, data=json.dumps(body), timeout=30)
+    resp = get_session().post(url, headers=headers, data=json.dumps(body), timeout=30)
     
     try:
         decrypted_body = decrypt_xdata(api_key, json.loads(resp.text))
@@ -458,7 +538,7 @@ def purchase_package(
     package_option_code:str,
     is_enterprise: bool = False
     ) -> dict:
-    package_details_data = get_package(api_key, tokens, package_option_code)
+    package_details_data = get_package(api_key, tokens, package_option_code, is_enterprise)
     if not package_details_data:
         print("Failed to get package details for purchase.")
         return None
@@ -587,6 +667,8 @@ def purchase_package(
     print("Processing purchase...")
     # print(f"settlement payload:\n{json.dumps(settlement_payload, indent=2)}")
     purchase_result = send_payment_request(api_key, settlement_payload, tokens["access_token"], tokens["id_token"], token_payment, ts_to_sign, payment_for)
+    # token_confirmation sudah terpakai, detail berikutnya harus diambil ulang
+    PackageDetailCacheInstance.discard(PackageDetailCacheInstance.make_key(tokens, package_option_code, is_enterprise))
     
     print(f"Purchase result:\n{json.dumps(purchase_result, indent=2)}")
     
@@ -623,41 +705,200 @@ def get_package_details(
     is_enterprise: bool,
     migration_type: str = "NONE"
 ) -> Union[dict, None]:
-    family_data = get_family(api_key, tokens, family_code, is_enterprise, migration_type)
-    if not family_data:
-        print(f"Gagal mengambil data family untuk {family_code}.")
-        return None
-    
-    package_options = []
-    
-    package_variants = family_data["package_variants"]
-    option_code = None
-    for variant in package_variants:
+    # Kode option diambil dari katalog (per segmen pelanggan); family diambil ulang jika
+    # belum pernah dimuat untuk segmen ini atau sudah lewat FAMILY_CACHE_TTL
+    family_key = PackageCatalogInstance.make_family_key(family_code, is_enterprise, migration_type, subscriber_segment(tokens))
+    option = PackageCatalogInstance.get_by_position(family_key, variant_name, option_order, max_age=FAMILY_CACHE_TTL)
+    if not option and not PackageCatalogInstance.has_family(family_key, max_age=FAMILY_CACHE_TTL):
+        family_data = get_family(api_key, tokens, family_code, is_enterprise, migration_type)
+        if not family_data:
+            print(f"Gagal mengambil data family untuk {family_code}.")
+            return None
+        PackageCatalogInstance.index_family(family_key, family_data)
+        option = PackageCatalogInstance.get_by_position(family_key, variant_name, option_order)
 
-        # if clean_text(variant["name"]) == variant_name:
-        #     selected_variant = variant
-            
-        #     package_options = selected_variant["package_options"]
-        #     for option in package_options:
-        #         if option["order"] == option_order:
-        #             selected_option = option
-        #             option_code = selected_option["package_option_code"]
-        #             break
-        package_options.extend(variant["package_options"])
-    
-    for option in package_options:
-        if option["order"] == option_order:
-            selected_option = option
-            option_code = selected_option["package_option_code"]
-            break
-
-    if option_code is None:
+    if option is None:
         print("Gagal menemukan opsi paket yang sesuai.")
         return None
         
-    package_details_data = get_package(api_key, tokens, option_code)
+    package_details_data = get_package(
+        api_key,
+        tokens,
+        option["package_option_code"],
+        is_enterprise,
+        family_code,
+        option.get("package_variant_code", "")
+    )
     if not package_details_data:
         print("Gagal mengambil detail paket.")
         return None
     
-    return package_details_data
\ No newline at end of file
+    return package_details_data
+
+
+# --- Versi async untuk handler bot ---
+# Semua fungsi di bawah memakai AsyncClient bersama dan tidak pernah memanggil
+# input(), sehingga aman di-await dari handler python-telegram-bot.
+
+async def get_otp_async(contact: str) -> str:
+    if not validate_contact(contact):
+        return None
+
+    print("Requesting OTP...")
+    try:
+        response = await get_async_client().get(GET_OTP_URL, headers=_otp_headers(), params=_otp_querystring(contact), timeout=30)
+        print("response body", response.text)
+        json_body = json.loads(response.text)
+    
+        if "subscriber_id" not in json_body:
+            print(json_body.get("error", "No error message in response"))
+            raise ValueError("Subscriber ID not found in response")
+        
+        return json_body["subscriber_id"]
+    except Exception as e:
+        print(f"Error requesting OTP: {e}")
+        return None
+
+async def submit_otp_async(api_key: str, contact: str, code: str):
+    if not _validate_otp_input(contact, code):
+        return None
+
+    now_gmt7 = datetime.now(timezone(timedelta(hours=7)))
+    ts_for_sign = ts_gmt7_without_colon(now_gmt7)
+    ts_header = ts_gmt7_without_colon(now_gmt7 - timedelta(minutes=5))
+    signature = await ax_api_signature_async(api_key, ts_for_sign, contact, code, "SMS")
+
+    payload = f"contactType=SMS&code={code}&grant_type=password&contact={contact}&scope=openid"
+    headers = _submit_otp_headers(signature, ts_header)
+
+    try:
+        response = await get_async_client().post(SUBMIT_OTP_URL, content=payload, headers=headers, timeout=30)
+        json_body = json.loads(response.text)
+        
+        if "error" in json_body:
+            print(f"[Error submit_otp]: {json_body['error_description']}")
+            return None
+        
+        print("Login successful.")
+        return json_body
+    except httpx.HTTPError as e:
+        print(f"[Error submit_otp]: {e}")
+        return None
+
+async def get_new_token_async(refresh_token: str) -> dict:
+    data = {
+        "grant_type": "refresh_token",
+        "refresh_token": refresh_token
+    }
+
+    resp = await get_async_client().post(SUBMIT_OTP_URL, headers=_refresh_token_headers(), data=data, timeout=30)
+    if resp.status_code == 400:
+        if resp.json().get("error_description") == "Session not active":
+            print("Refresh token expired. Pleas remove and re-add the account.")
+            return None
+        
+    resp.raise_for_status()
+
+    return _parse_new_token(resp.json())
+
+async def send_api_request_async(
+    api_key: str,
+    path: str,
+    payload_dict: dict,
+    id_token: str,
+    method: str = "POST",
+):
+    key = request_key(path, payload_dict, id_token)
+    if key is None:
+        return await _send_api_request_async(api_key, path, payload_dict, id_token, method)
+    return await api_single_flight.do_async(key, lambda: _send_api_request_async(api_key, path, payload_dict, id_token, method))
+
+async def _send_api_request_async(
+    api_key: str,
+    path: str,
+    payload_dict: dict,
+    id_token: str,
+    method: str = "POST",
+):
+    encrypted_payload = await encryptsign_xdata_async(
+        api_key=api_key,
+        method=method,
+        path=path,
+        id_token=id_token,
+        payload=payload_dict
+    )
+
+    url, headers, body = build_api_request(path, encrypted_payload, id_token)
+    resp = await get_async_client().post(url, headers=headers, content=body, timeout=30)
+
+    try:
+        decrypted_body = await decrypt_xdata_async(api_key, json.loads(resp.text))
+        return decrypted_body
+    except Exception as e:
+        print("[decrypt err]", e)
+        return resp.text
+
+async def get_balance_async(api_key: str, id_token: str) -> dict:
+    path = "api/v8/packages/balance-and-credit"
+    
+    raw_payload = {
+        "is_enterprise": False,
+        "lang": "en"
+    }
+    
+    print("Fetching balance...")
+    res = await send_api_request_async(api_key, path, raw_payload, id_token, "POST")
+    if not isinstance(res, dict):
+        print("Error getting balance:", res)
+        return None
+    
+    if "data" in res:
+        if "balance" in res["data"]:
+            return res["data"]["balance"]
+    else:
+        print("Error getting balance:", res.get("error", "Unknown error"))
+        return None
+
+async def get_family_async(
+    api_key: str,
+    tokens: dict,
+    family_code: str,
+    is_enterprise: bool = False,
+    migration_type: str = "NONE"
+) -> dict:
+    print("Fetching package family...")
+    path = "api/v8/xl-stores/options/list"
+    payload_dict = family_payload(family_code, is_enterprise, migration_type)
+    
+    res = await send_api_request_async(api_key, path, payload_dict, tokens.get("id_token"), "POST")
+    if not isinstance(res, dict) or res.get("status") != "SUCCESS":
+        print(f"Failed to get family {family_code}")
+        print(res)
+        return None
+    return res["data"]
+
+async def get_package_async(
+    api_key: str,
+    tokens: dict,
+    package_option_code: str,
+    is_enterprise: bool,
+    package_family_code: str = "",
+    package_variant_code: str = ""
+    ) -> dict:
+    cache_key = PackageDetailCacheInstance.make_key(tokens, package_option_code, is_enterprise)
+    cached = PackageDetailCacheInstance.get(cache_key)
+    if cached:
+        return cached
+
+    path = "api/v8/xl-stores/options/detail"
+    raw_payload = package_payload(package_option_code, is_enterprise, package_family_code, package_variant_code)
+    
+    print("Fetching package details...")
+    res = await send_api_request_async(api_key, path, raw_payload, tokens["id_token"], "POST")
+    
+    if not isinstance(res, dict) or "data" not in res:
+        print("Error getting package:", res)
+        return None
+        
+    PackageDetailCacheInstance.put(cache_key, res["data"])
+    return res["data"]
@@ -0,0 +1,73 @@
+import os
+import threading
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+# Ukuran pool bisa diatur lewat .env.
+# HTTP_POOL_CONNECTIONS = jumlah host yang pool-nya disimpan (per-host pool)
+# HTTP_POOL_MAXSIZE     = jumlah koneksi keep-alive maksimum per host
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "16"))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "64"))
+HTTP_POOL_BLOCK = os.getenv("HTTP_POOL_BLOCK", "false").lower() == "true"
+
+_session = None
+_session_lock = threading.Lock()
+
+def _build_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_CONNECTIONS,
+        pool_maxsize=HTTP_POOL_MAXSIZE,
+        pool_block=HTTP_POOL_BLOCK,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def get_session() -> requests.Session:
+    """
+    Session bersama untuk semua pemanggilan di app/client.
+    Koneksi TCP+TLS ke tiap host (crypto service, XL API, CIAM, Atlantic)
+    disimpan di pool dan dipakai ulang, jadi tidak ada handshake baru per request.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+def close_session():
+    """Menutup semua koneksi di pool (dipanggil saat shutdown)."""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+# --- Klien async (httpx) untuk handler bot ---
+# httpx sudah ikut terpasang bersama python-telegram-bot.
+_async_client = None
+
+def get_async_client() -> httpx.AsyncClient:
+    """
+    AsyncClient bersama untuk handler Telegram. Batas pool mengikuti
+    pengaturan yang sama dengan session sync di atas.
+    """
+    global _async_client
+    if _async_client is None or _async_client.is_closed:
+        _async_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=HTTP_POOL_CONNECTIONS * HTTP_POOL_MAXSIZE,
+                max_keepalive_connections=HTTP_POOL_MAXSIZE,
+            ),
+            timeout=30,
+        )
+    return _async_client
+
+async def close_async_client():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
@@ -0,0 +1,151 @@
+import os
+import json
+import asyncio
+from typing import List
+from app.client.http import get_async_client
+from app.client.encrypt import encryptsign_xdata_async, decrypt_xdata_async
+from app.client.engsel import build_api_request, family_payload
+
+# Jumlah request yang boleh berjalan bersamaan di tiap tahap.
+PIPELINE_ENCRYPT_DEPTH = int(os.getenv("PIPELINE_ENCRYPT_DEPTH", "4"))
+PIPELINE_POST_DEPTH = int(os.getenv("PIPELINE_POST_DEPTH", "8"))
+PIPELINE_DECRYPT_DEPTH = int(os.getenv("PIPELINE_DECRYPT_DEPTH", "4"))
+
+class ApiPipeline:
+    """
+    Menjalankan banyak send_api_request sebagai pipeline tiga tahap:
+    encryptsign -> POST ke XL API -> decrypt.
+
+    Tiap tahap punya worker sendiri dengan jumlah in-flight terbatas, jadi
+    selama request N berada di XL API, request N+1 sudah dienkripsi dan
+    request N-1 sedang didekripsi. Waktu total mendekati tahap paling lambat,
+    bukan jumlah ketiga tahap.
+
+    Tiap request adalah dict: {"path", "payload", "id_token", "method"(opsional)}.
+    Hasil dikembalikan sesuai urutan input, dengan arti yang sama seperti nilai
+    balik send_api_request (dict hasil decrypt, atau teks mentah jika decrypt
+    gagal). Request yang gagal di tahap encrypt/POST bernilai None.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        encrypt_depth: int = PIPELINE_ENCRYPT_DEPTH,
+        post_depth: int = PIPELINE_POST_DEPTH,
+        decrypt_depth: int = PIPELINE_DECRYPT_DEPTH,
+    ):
+        self.api_key = api_key
+        self.encrypt_depth = encrypt_depth
+        self.post_depth = post_depth
+        self.decrypt_depth = decrypt_depth
+
+    async def run(self, requests: List[dict]) -> list:
+        results = [None] * len(requests)
+
+        encrypt_q = asyncio.Queue(maxsize=self.encrypt_depth)
+        post_q = asyncio.Queue(maxsize=self.post_depth)
+        decrypt_q = asyncio.Queue(maxsize=self.decrypt_depth)
+
+        async def feed():
+            for index, request in enumerate(requests):
+                await encrypt_q.put((index, request))
+            for _ in range(self.encrypt_depth):
+                await encrypt_q.put(None)
+
+        async def store(item):
+            index, value = item
+            results[index] = value
+
+        await asyncio.gather(
+            feed(),
+            self._stage(encrypt_q, self.encrypt_depth, self._encrypt, post_q, self.post_depth),
+            self._stage(post_q, self.post_depth, self._post, decrypt_q, self.decrypt_depth),
+            self._stage(decrypt_q, self.decrypt_depth, self._decrypt, None, 0, store),
+        )
+        return results
+
+    async def _stage(self, in_q, workers, fn, out_q, next_workers, sink=None):
+        async def worker():
+            while True:
+                item = await in_q.get()
+                if item is None:
+                    return
+                out = await fn(item)
+                if out is None:
+                    continue
+                if out_q is not None:
+                    await out_q.put(out)
+                else:
+                    await sink(out)
+
+        await asyncio.gather(*(worker() for _ in range(workers)))
+        if out_q is not None:
+            for _ in range(next_workers):
+                await out_q.put(None)
+
+    async def _encrypt(self, item):
+        index, request = item
+        try:
+            encrypted_payload = await encryptsign_xdata_async(
+                api_key=self.api_key,
+                method=request.get("method", "POST"),
+                path=request["path"],
+                id_token=request["id_token"],
+                payload=request["payload"]
+            )
+            url, headers, body = build_api_request(request["path"], encrypted_payload, request["id_token"])
+            return index, url, headers, body
+        except Exception as e:
+            print(f"[pipeline encrypt err] {request.get('path')}: {e}")
+            return None
+
+    async def _post(self, item):
+        index, url, headers, body = item
+        try:
+            resp = await get_async_client().post(url, headers=headers, content=body, timeout=30)
+            return index, resp.text
+        except Exception as e:
+            print(f"[pipeline post err] {url}: {e}")
+            return None
+
+    async def _decrypt(self, item):
+        index, text = item
+        try:
+            return index, await decrypt_xdata_async(self.api_key, json.loads(text))
+        except Exception as e:
+            print("[decrypt err]", e)
+            return index, text
+
+async def get_families_pipelined(
+    api_key: str,
+    tokens: dict,
+    families: List[dict],
+    migration_type: str = "NONE",
+    pipeline: ApiPipeline = None
+) -> list:
+    """
+    Mengambil banyak family sekaligus lewat ApiPipeline.
+    'families' berbentuk seperti PREDEFINED_FAMILY_CODES
+    ({"family_code", "is_enterprise", ...}). Hasil berurutan sama dengan
+    input; family yang gagal bernilai None.
+    """
+    path = "api/v8/xl-stores/options/list"
+    requests = [
+        {
+            "path": path,
+            "payload": family_payload(family["family_code"], family.get("is_enterprise", False), migration_type),
+            "id_token": tokens.get("id_token"),
+        }
+        for family in families
+    ]
+
+    responses = await (pipeline or ApiPipeline(api_key)).run(requests)
+
+    results = []
+    for family, res in zip(families, responses):
+        if isinstance(res, dict) and res.get("status") == "SUCCESS":
+            results.append(res["data"])
+        else:
+            print(f"Failed to get family {family['family_code']}")
+            results.append(None)
+    return results
@@ -6,6 +6,7 @@ import qrcode
 
 import time
 import requests
+from app.client.http import get_session
 from app.client.engsel import *
 from app.client.encrypt import API_KEY, build_encrypted_field, decrypt_xdata, encryptsign_xdata, java_like_timestamp, get_x_signature_payment, get_x_signature_bounty
 
@@ -21,7 +22,20 @@ def get_payment_methods(
     payment_target: str,
 ):
     payment_path = "payments/api/v8/payment-methods-option"
-    payment_payload = {
+    payment_payload = payment_methods_payload(payment_target, token_confirmation)
+    
+    payment_res = send_api_request(api_key, payment_path, payment_payload, tokens["id_token"], "POST")
+    if payment_res["status"] != "SUCCESS":
+        print("Failed to fetch payment methods.")
+        print(f"Error: {payment_res}")
+        return None
+    
+    
+    
+    return payment_res["data"]
+
+def payment_methods_payload(payment_target: str, token_confirmation: str) -> dict:
+    return {
         "payment_type": "PURCHASE",
         "is_enterprise": False,
         "payment_target": payment_target,
@@ -29,15 +43,22 @@ def get_payment_methods(
         "is_referral": False,
         "token_confirmation": token_confirmation
     }
+
+async def get_payment_methods_async(
+    api_key: str,
+    tokens: dict,
+    token_confirmation: str,
+    payment_target: str,
+):
+    payment_path = "payments/api/v8/payment-methods-option"
+    payment_payload = payment_methods_payload(payment_target, token_confirmation)
     
-    payment_res = send_api_request(api_key, payment_path, payment_payload, tokens["id_token"], "POST")
-    if payment_res["status"] != "SUCCESS":
+    payment_res = await send_api_request_async(api_key, payment_path, payment_payload, tokens["id_token"], "POST")
+    if not isinstance(payment_res, dict) or payment_res.get("status") != "SUCCESS":
         print("Failed to fetch payment methods.")
         print(f"Error: {payment_res}")
         return None
     
-    
-    
     return payment_res["data"]
 
 def settlement_qris(
@@ -156,7 +177,7 @@ def settlement_qris(
     
     url = f"{BASE_API_URL}/{path}"
     print("Sending settlement request...")
-    resp = requests.post(url, headers=headers, data=json.dumps(body), timeout=30)
+    resp = get_session().post(url, headers=headers, data=json.dumps(body), timeout=30)
     
     try:
         decrypted_body = decrypt_xdata(api_key, json.loads(resp.text))
@@ -365,7 +386,7 @@ def settlement_bounty(
     
     url = f"{BASE_API_URL}/{path}"
     print("Sending bounty request...")
-    resp = requests.post(url, headers=headers, data=json.dumps(body), timeout=30)
+    resp = get_session().post(url, headers=headers, data=json.dumps(body), timeout=30)
     
     try:
         decrypted_body = decrypt_xdata(api_key, json.loads(resp.text))
@@ -6,10 +6,52 @@ import qrcode
 from typing import List
 import time
 import requests
+from app.client.http import get_session, get_async_client
 from app.client.engsel import *
 from app.client.encrypt import API_KEY, build_encrypted_field, decrypt_xdata, encryptsign_xdata, java_like_timestamp, get_x_signature_payment, get_x_signature_bounty
+from app.client.purchase import payment_methods_payload
+from app.service.package_catalog import PackageDetailCacheInstance
+from app.client.encrypt import encryptsign_xdata_async, decrypt_xdata_async, get_x_signature_payment_async
 from app.type_dict import PaymentItem
 
+def join_payment_targets(items: List[PaymentItem]) -> str:
+    return ";".join(item["item_code"] for item in items)
+
+def _qris_v2_settlement_payload(tokens: dict, items: List[PaymentItem], amount_int: int, token_payment: str) -> dict:
+    return {
+        "akrab": {
+            "akrab_members": [],
+            "akrab_parent_alias": "",
+            "members": []
+        },
+        "can_trigger_rating": False,
+        "total_discount": 0,
+        "coupon": "",
+        "payment_for": "BUY_PACKAGE",
+        "topup_number": "",
+        "is_enterprise": False,
+        "autobuy": {
+            "is_using_autobuy": False,
+            "activated_autobuy_code": "",
+            "autobuy_threshold_setting": {
+            "label": "",
+            "type": "",
+            "value": 0
+            }
+        },
+        "access_token": tokens["access_token"],
+        "is_myxl_wallet": False,
+        "additional_data": {},
+        "total_amount": amount_int,
+        "total_fee": 0,
+        "is_use_point": False,
+        "lang": "en",
+        "items": items,
+        "verification_token": token_payment,
+        "payment_method": "QRIS",
+        "timestamp": int(time.time()),
+    }
+
 def settlement_qris_v2(
     api_key: str,
     tokens: dict,
@@ -17,11 +59,7 @@ def settlement_qris_v2(
     ask_overwrite: bool = True,
 ):  
     token_confirmation = items[0]["token_confirmation"]
-    payment_targets = ""
-    for item in items:
-        if payment_targets != "":
-            payment_targets += ";"
-        payment_targets += item["item_code"]
+    payment_targets = join_payment_targets(items)
     
     amount_int = items[-1]["item_price"]
     
@@ -37,14 +75,7 @@ def settlement_qris_v2(
     
     # Get payment methods
     payment_path = "payments/api/v8/payment-methods-option"
-    payment_payload = {
-        "payment_type": "PURCHASE",
-        "is_enterprise": False,
-        "payment_target": items[0]["item_code"],
-        "lang": "en",
-        "is_referral": False,
-        "token_confirmation": token_confirmation
-    }
+    payment_payload = payment_methods_payload(items[0]["item_code"], token_confirmation)
     
     print("Getting payment methods...")
     payment_res = send_api_request(api_key, payment_path, payment_payload, tokens["id_token"], "POST")
@@ -58,39 +89,7 @@ def settlement_qris_v2(
     
     # Settlement request
     path = "payments/api/v8/settlement-multipayment/qris"
-    settlement_payload = {
-        "akrab": {
-            "akrab_members": [],
-            "akrab_parent_alias": "",
-            "members": []
-        },
-        "can_trigger_rating": False,
-        "total_discount": 0,
-        "coupon": "",
-        "payment_for": "BUY_PACKAGE",
-        "topup_number": "",
-        "is_enterprise": False,
-        "autobuy": {
-            "is_using_autobuy": False,
-            "activated_autobuy_code": "",
-            "autobuy_threshold_setting": {
-            "label": "",
-            "type": "",
-            "value": 0
-            }
-        },
-        "access_token": tokens["access_token"],
-        "is_myxl_wallet": False,
-        "additional_data": {},
-        "total_amount": amount_int,
-        "total_fee": 0,
-        "is_use_point": False,
-        "lang": "en",
-        "items": items,
-        "verification_token": token_payment,
-        "payment_method": "QRIS",
-        "timestamp": int(time.time()),
-    }
+    settlement_payload = _qris_v2_settlement_payload(tokens, items, amount_int, token_payment)
     
     encrypted_payload = encryptsign_xdata(
         api_key=api_key,
@@ -100,12 +99,7 @@ def settlement_qris_v2(
         payload=settlement_payload
     )
     
-    xtime = int(encrypted_payload["encrypted_body"]["xtime"])
-    sig_time_sec = (xtime // 1000)
-    x_requested_at = datetime.fromtimestamp(sig_time_sec, tz=timezone.utc).astimezone()
     settlement_payload["timestamp"] = ts_to_sign
-    
-    body = encrypted_payload["encrypted_body"]
     x_sig = get_x_signature_payment(
             api_key,
             tokens["access_token"],
@@ -115,23 +109,9 @@ def settlement_qris_v2(
             "QRIS"
         )
     
-    headers = {
-        "host": BASE_API_URL.replace("https://", ""),
-        "content-type": "application/json; charset=utf-8",
-        "user-agent": UA,
-        "x-api-key": API_KEY,
-        "authorization": f"Bearer {tokens['id_token']}",
-        "x-hv": "v3",
-        "x-signature-time": str(sig_time_sec),
-        "x-signature": x_sig,
-        "x-request-id": str(uuid.uuid4()),
-        "x-request-at": java_like_timestamp(x_requested_at),
-        "x-version-app": "8.7.0",
-    }
-    
-    url = f"{BASE_API_URL}/{path}"
+    url, headers, body = build_settlement_request(path, encrypted_payload, tokens["id_token"], x_sig)
     print("Sending settlement request...")
-    resp = requests.post(url, headers=headers, data=json.dumps(body), timeout=30)
+    resp = get_session().post(url, headers=headers, data=body, timeout=30)
     
     try:
         decrypted_body = decrypt_xdata(api_key, json.loads(resp.text))
@@ -198,3 +178,104 @@ def get_qris_payment_data(
     qris_url = f"https://ki-ar-kod.netlify.app/?data={qris_b64}"
     
     return qris_url
+
+
+# --- Versi async untuk handler bot ---
+
+async def settlement_qris_v2_async(
+    api_key: str,
+    tokens: dict,
+    items: List[PaymentItem],
+):
+    token_confirmation = items[0]["token_confirmation"]
+    payment_targets = join_payment_targets(items)
+    amount_int = items[-1]["item_price"]
+
+    payment_path = "payments/api/v8/payment-methods-option"
+    payment_payload = payment_methods_payload(items[0]["item_code"], token_confirmation)
+
+    print("Getting payment methods...")
+    payment_res = await send_api_request_async(api_key, payment_path, payment_payload, tokens["id_token"], "POST")
+    if not isinstance(payment_res, dict) or payment_res.get("status") != "SUCCESS":
+        print("Failed to fetch payment methods.")
+        print(f"Error: {payment_res}")
+        return None
+
+    token_payment = payment_res["data"]["token_payment"]
+    ts_to_sign = payment_res["data"]["timestamp"]
+
+    path = "payments/api/v8/settlement-multipayment/qris"
+    settlement_payload = _qris_v2_settlement_payload(tokens, items, amount_int, token_payment)
+
+    encrypted_payload = await encryptsign_xdata_async(
+        api_key=api_key,
+        method="POST",
+        path=path,
+        id_token=tokens["id_token"],
+        payload=settlement_payload
+    )
+
+    x_sig = await get_x_signature_payment_async(
+            api_key,
+            tokens["access_token"],
+            ts_to_sign,
+            payment_targets,
+            token_payment,
+            "QRIS"
+        )
+
+    url, headers, body = build_settlement_request(path, encrypted_payload, tokens["id_token"], x_sig)
+    print("Sending settlement request...")
+    resp = await get_async_client().post(url, headers=headers, content=body, timeout=30)
+    # token_confirmation sudah terpakai, detail paket berikutnya harus diambil ulang
+    PackageDetailCacheInstance.discard_items(tokens, items)
+
+    try:
+        decrypted_body = await decrypt_xdata_async(api_key, json.loads(resp.text))
+        if decrypted_body["status"] != "SUCCESS":
+            print("Failed to initiate settlement.")
+            print(f"Error: {decrypted_body}")
+            return None
+
+        return decrypted_body["data"]["transaction_code"]
+    except Exception as e:
+        print("[decrypt err]", e)
+        return None
+
+async def get_qris_code_async(
+    api_key: str,
+    tokens: dict,
+    transaction_id: str
+):
+    path = "payments/api/v8/pending-detail"
+    payload = {
+        "transaction_id": transaction_id,
+        "is_enterprise": False,
+        "lang": "en",
+        "status": ""
+    }
+
+    res = await send_api_request_async(api_key, path, payload, tokens["id_token"], "POST")
+    if not isinstance(res, dict) or res.get("status") != "SUCCESS":
+        print("Failed to fetch QRIS code.")
+        print(f"Error: {res}")
+        return None
+
+    return res["data"]["qr_code"]
+
+async def get_qris_payment_data_async(
+    api_key: str,
+    tokens: dict,
+    items: List[PaymentItem],
+):
+    """Versi async dari get_qris_payment_data untuk handler bot."""
+    transaction_id = await settlement_qris_v2_async(api_key, tokens, items)
+    if not transaction_id:
+        return None
+
+    qris_code = await get_qris_code_async(api_key, tokens, transaction_id)
+    if not qris_code:
+        return None
+
+    qris_b64 = base64.urlsafe_b64encode(qris_code.encode()).decode()
+    return f"https://ki-ar-kod.netlify.app/?data={qris_b64}"
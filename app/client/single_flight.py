@@ -0,0 +1,106 @@
+import copy
+import json
+import asyncio
+import threading
+from app.util import decode_jwt_claims, subscriber_segment
+
+# Endpoint baca yang aman digabung. Nilainya menentukan siapa yang boleh
+# berbagi hasil: "segment" = semua pelanggan dengan segmen sama,
+# "subscriber" = hanya pelanggan yang sama (respons berisi token_confirmation).
+SINGLE_FLIGHT_PATHS = {
+    "api/v8/xl-stores/families": "segment",
+    "api/v8/xl-stores/options/list": "segment",
+    "api/v8/xl-stores/options/detail": "subscriber",
+    "api/v8/xl-stores/options/addons-pinky-box": "segment",
+}
+
+def request_key(path: str, payload: dict, id_token: str):
+    """Kunci single-flight untuk request, atau None jika path tidak boleh digabung."""
+    scope = SINGLE_FLIGHT_PATHS.get(path)
+    if scope is None:
+        return None
+    if scope == "subscriber":
+        owner = decode_jwt_claims(id_token or "").get("sub") or id_token
+    else:
+        owner = subscriber_segment({"id_token": id_token})
+    return (path, json.dumps(payload, sort_keys=True, separators=(",", ":")), owner)
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """
+    Menggabungkan request identik yang sedang berjalan bersamaan.
+    Pemanggil pertama menjalankan request; pemanggil lain dengan kunci yang
+    sama menunggu dan menerima salinan hasilnya. Tidak ada cache: begitu
+    request selesai, pemanggilan berikutnya kembali ke server.
+    """
+
+    def __init__(self):
+        self._calls = {}        # key -> _Call (thread)
+        self._async_calls = {}  # key -> asyncio.Future
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "shared": 0}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.stats["calls"] += 1
+            else:
+                self.stats["shared"] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    async def do_async(self, key, fn):
+        future = self._async_calls.get(key)
+        if future is not None:
+            self.stats["shared"] += 1
+            try:
+                return copy.deepcopy(await asyncio.shield(future))
+            except asyncio.CancelledError:
+                # Pemanggil pertama dibatalkan: jalankan request sendiri
+                if not future.cancelled():
+                    raise
+                return await fn()
+
+        future = asyncio.get_running_loop().create_future()
+        self._async_calls[key] = future
+        self.stats["calls"] += 1
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # tandai sudah dibaca walau tidak ada yang menunggu
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            if self._async_calls.get(key) is future:
+                del self._async_calls[key]
+
+api_single_flight = SingleFlight()
@@ -10,7 +10,7 @@ ATLANTIC_BASE_URL = "https://atlantich2h.com"
 ADMIN_IDS = [8372210994] 
 
 user_states = {}
-reff_id_to_chat_id_map = {}
+# reff_id deposit -> chat_id ada di app/service/reff_id_store.py (SQLite, dipakai bersama webhook server)
 
 # Definisi State Pengguna
 USER_STATE_MENU_MAIN = 0
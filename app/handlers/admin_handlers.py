@@ -1,11 +1,16 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 import math
+import time
 
 from app.service.auth import AuthInstance
 from app.service.balance_service import BalanceServiceInstance
+from app.service.catalog_warmer import CatalogWarmerInstance
+from app.service.family_cache import FamilyCacheInstance
+from app.service.token_refresher import TokenRefresherInstance
 from .user_handlers import show_main_menu_bot, start
 from app.config import user_states, ADMIN_IDS, USER_STATE_ADMIN_TOPUP_NUMBER, USER_STATE_ADMIN_TOPUP_AMOUNT, USER_STATE_ADMIN_SWITCH_NUMBER
+from .state_router import register_state_handler
 
 async def admin_panel_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -15,10 +20,12 @@ async def admin_panel_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
         [InlineKeyboardButton("➕ Top Up Saldo User", callback_data='admin_topup')],
         [InlineKeyboardButton("👤 Switch ke User", callback_data='admin_switch')],
         [InlineKeyboardButton("📊 Daftar User", callback_data='admin_list_users_0')],
+        [InlineKeyboardButton("📦 Status Katalog", callback_data='admin_catalog')],
+        [InlineKeyboardButton("🔑 Status Token", callback_data='admin_tokens')],
         [InlineKeyboardButton("« Kembali", callback_data='menu_back_main')]
     ]
     if chat_id in AuthInstance.impersonation_map:
-        keyboard.insert(3, [InlineKeyboardButton("↩️ Kembali ke Akun Admin", callback_data='admin_switchback')])
+        keyboard.insert(5, [InlineKeyboardButton("↩️ Kembali ke Akun Admin", callback_data='admin_switchback')])
     await query.message.edit_text("⚙️ *Panel Admin*\n\nPilih aksi yang ingin Anda lakukan:", reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="Markdown")
 
 async def admin_action_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -37,6 +44,10 @@ async def admin_action_handler(update: Update, context: ContextTypes.DEFAULT_TYP
         result_message = AuthInstance.stop_impersonation(chat_id)
         await query.message.edit_text(result_message)
         await show_main_menu_bot(update, context)
+    elif action == 'catalog':
+        await query.message.edit_text(format_catalog_status(), reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("« Kembali ke Panel Admin", callback_data="admin_panel")]]), parse_mode="Markdown")
+    elif action == 'tokens':
+        await query.message.edit_text(format_token_status(), reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("« Kembali ke Panel Admin", callback_data="admin_panel")]]), parse_mode="Markdown")
     elif action == 'list' and data_parts[2] == 'users':
         page = int(data_parts[3])
         ITEMS_PER_PAGE = 5
@@ -61,6 +72,33 @@ async def admin_action_handler(update: Update, context: ContextTypes.DEFAULT_TYP
         keyboard.append([InlineKeyboardButton("« Kembali ke Panel Admin", callback_data="admin_panel")])
         await query.message.edit_text(message, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="Markdown")
 
+def format_catalog_status() -> str:
+    now = time.time()
+    stats = FamilyCacheInstance.stats
+    message = (f"📦 *Status Katalog*\n"
+               f"Cache: {stats['hits']} hit, {stats['stale_hits']} stale, {stats['misses']} miss\n\n")
+    for item in CatalogWarmerInstance.get_status():
+        if item["fetched_at"]:
+            age = f"{int((now - item['fetched_at']) // 60)} mnt lalu"
+        else:
+            age = "belum dimuat"
+        if item["failures"]:
+            age += f" ⚠️ gagal {item['failures']}x"
+        message += f"- {item['name']}: {age}\n"
+    return message
+
+def format_token_status() -> str:
+    metrics = TokenRefresherInstance.get_metrics()
+    message = (f"🔑 *Status Token*\n"
+               f"Sesi aktif: {metrics['active_sessions']}\n"
+               f"Refresh berhasil: {metrics['refreshes']}\n"
+               f"Refresh gagal: {metrics['failures']} ({metrics['failing_sessions']} sesi masih gagal)\n"
+               f"Latensi: rata-rata {metrics['avg_latency_ms']} ms, terakhir {metrics['last_latency_ms']} ms, maks {metrics['max_latency_ms']} ms\n")
+    if metrics["last_error"]:
+        message += f"Error terakhir: `{metrics['last_error'][:100]}`\n"
+    return message
+
+@register_state_handler(USER_STATE_ADMIN_TOPUP_NUMBER, USER_STATE_ADMIN_TOPUP_AMOUNT, USER_STATE_ADMIN_SWITCH_NUMBER)
 async def admin_input_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
     chat_id = update.effective_chat.id
     text = update.message.text
@@ -78,8 +116,7 @@ async def admin_input_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
             amount = float(text.strip())
             target_chat_id_str = context.user_data.get('admin_target_chat_id')
             target_chat_id = int(target_chat_id_str)
-            BalanceServiceInstance.add_balance(target_chat_id, amount)
-            new_balance = BalanceServiceInstance.get_balance(target_chat_id)
+            new_balance = await BalanceServiceInstance.add_balance_async(target_chat_id, amount, kind="admin_topup", reference=str(chat_id))
             await update.message.reply_text(f"✅ Berhasil! Saldo untuk pengguna ID {target_chat_id} telah ditambahkan.\nSaldo baru: Rp {new_balance:,.0f}")
         except (ValueError, TypeError):
             await update.message.reply_text("Input tidak valid. Harap masukkan ID dan jumlah yang benar.")
@@ -89,7 +126,7 @@ async def admin_input_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
     elif current_state == USER_STATE_ADMIN_SWITCH_NUMBER:
         try:
             target_number = int(text.strip())
-            result_message = AuthInstance.start_impersonation(chat_id, target_number)
+            result_message = await AuthInstance.start_impersonation_async(chat_id, target_number)
             await update.message.reply_text(result_message)
         except (ValueError, TypeError):
             await update.message.reply_text("Nomor tidak valid. Harap masukkan nomor HP pengguna.")
@@ -108,8 +145,7 @@ async def admin_topup_command(update: Update, context: ContextTypes.DEFAULT_TYPE
             await update.message.reply_text("Format salah. Gunakan: /topup <target_chat_id> <jumlah>")
             return
         target_chat_id, amount = int(parts[0]), float(parts[1])
-        BalanceServiceInstance.add_balance(target_chat_id, amount)
-        new_balance = BalanceServiceInstance.get_balance(target_chat_id)
+        new_balance = await BalanceServiceInstance.add_balance_async(target_chat_id, amount, kind="admin_topup", reference=str(update.effective_user.id))
         await update.message.reply_text(f"✅ Berhasil! Saldo untuk pengguna ID {target_chat_id} telah ditambahkan.\nSaldo baru: Rp {new_balance:,.0f}")
     except (IndexError, ValueError) as e:
         await update.message.reply_text(f"Error: {e}\nFormat salah. Gunakan: /topup <target_chat_id> <jumlah>")
@@ -9,7 +9,10 @@ from app.service.bookmark import BookmarkInstance
 from app.data.package_data import PREDEFINED_FAMILY_CODES
 from app.menus.package import get_packages_by_family_data
 from app.menus.hot import get_hot_packages_data, get_hot2_packages_data
-from app.client.engsel import get_family, get_package
+from app.client.engsel import get_package_async
+from app.service.family_cache import FamilyCacheInstance
+from app.service.package_catalog import PackageCatalogInstance
+from app.util import subscriber_segment
 
 # Impor dari handler lain
 from .user_handlers import show_main_menu_bot
@@ -27,7 +30,7 @@ async def get_full_package_details_from_hot_data(context: ContextTypes.DEFAULT_T
     berdasarkan data pintasan dari file JSON (untuk paket HOT).
     """
     api_key = AuthInstance.api_key
-    active_user = AuthInstance.get_active_user(chat_id)
+    active_user = await AuthInstance.get_active_user_async(chat_id)
     if not active_user: return None
     
     tokens = active_user["tokens"]
@@ -39,28 +42,27 @@ async def get_full_package_details_from_hot_data(context: ContextTypes.DEFAULT_T
     if not all([family_code, target_variant_name, target_order is not None]):
         return None
         
-    family_data = get_family(api_key, tokens, family_code, is_enterprise)
+    # Lewat FamilyCache (TTL + refresh per segmen pelanggan), lalu option dicari
+    # di katalog dengan kunci family yang sama
+    family_data = await FamilyCacheInstance.get_family(api_key, tokens, family_code, is_enterprise)
     if not family_data or "package_variants" not in family_data:
         return None
+    family_key = FamilyCacheInstance.make_key(family_code, is_enterprise, "NONE", subscriber_segment(tokens))
+    option = PackageCatalogInstance.get_by_position(family_key, target_variant_name, target_order)
+    if not option:
+        return None
+
+    package_name = option.get("name")
+    package_code = option.get("package_option_code")
+    if not package_name or not package_code:
+        return None
 
-    for variant in family_data.get("package_variants", []):
-        if variant.get("name") == target_variant_name:
-            for option in variant.get("package_options", []):
-                if option.get("order") == target_order:
-                    package_name = option.get("name")
-                    package_code = option.get("package_option_code")
-                    if not package_name or not package_code:
-                        return None
-                    
-                    full_details = option
-                    full_details['token_confirmation'] = ""
-                    full_details['item_code'] = package_code
-                    full_details['name'] = package_name
-                    # Tambahkan info penting lain yang mungkin kurang
-                    full_details['family_code'] = family_code
-                    full_details['package_variant_code'] = variant.get("package_variant_code")
-                    return full_details
-    return None
+    # Salin agar data di katalog tidak ikut berubah
+    full_details = dict(option)
+    full_details['token_confirmation'] = ""
+    full_details['item_code'] = package_code
+    full_details['name'] = package_name
+    return full_details
 
 def format_package_benefits(package_details: dict) -> str:
     """Mengubah data benefit dari API menjadi teks yang rapi dan mudah dibaca."""
@@ -157,14 +159,14 @@ async def show_predefined_packages_menu(update: Update, context: ContextTypes.DE
 
 async def search_packages_and_display(update: Update, context: ContextTypes.DEFAULT_TYPE, family_code: str, is_enterprise: bool):
     chat_id = update.effective_chat.id
-    active_user = AuthInstance.get_active_user(chat_id)
+    active_user = await AuthInstance.get_active_user_async(chat_id)
     if not active_user:
         await context.bot.send_message(chat_id=chat_id, text="Sesi Anda tidak ditemukan, silakan login kembali.")
         await show_main_menu_bot(update, context)
         return
 
     tokens = active_user.get("tokens")
-    packages = get_packages_by_family_data(family_code, is_enterprise, tokens) 
+    packages = await get_packages_by_family_data(family_code, is_enterprise, tokens)
     
     if not packages:
         await context.bot.send_message(chat_id=chat_id, text="😢 Tidak ditemukan paket untuk family code ini.")
@@ -229,7 +231,7 @@ async def package_selection_callback_handler(update: Update, context: ContextTyp
 
     selected_shortcut = packages_data[choice_idx]
     
-    active_user = AuthInstance.get_active_user(chat_id)
+    active_user = await AuthInstance.get_active_user_async(chat_id)
     if not active_user:
         await query.message.edit_text("Sesi Anda berakhir, silakan /start lagi.")
         return
@@ -254,7 +256,7 @@ async def package_selection_callback_handler(update: Update, context: ContextTyp
     is_enterprise = complete_package_data.get('is_enterprise', False) 
     
     # Panggil API dengan semua parameter yang dibutuhkan, termasuk is_enterprise
-    full_details = get_package(
+    full_details = await get_package_async(
         api_key=AuthInstance.api_key, 
         tokens=tokens, 
         package_option_code=package_option_code,
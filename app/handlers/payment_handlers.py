@@ -8,8 +8,8 @@ import io
 # Impor layanan dan data
 from app.service.auth import AuthInstance
 from app.service.balance_service import BalanceServiceInstance
-from app.client.qris import get_qris_payment_data
-from app.client.ewallet import settlement_multipayment_v2
+from app.client.qris import get_qris_payment_data_async
+from app.client.ewallet import settlement_multipayment_v2_async
 
 # Impor dari handler lain
 from .user_handlers import show_main_menu_bot, start
@@ -22,7 +22,7 @@ async def purchase_callback_handler(update: Update, context: ContextTypes.DEFAUL
     await query.answer()
     chat_id = update.effective_chat.id
     if query.data == 'confirm_purchase':
-        active_user = AuthInstance.get_active_user(chat_id)
+        active_user = await AuthInstance.get_active_user_async(chat_id)
         if not active_user:
             await context.bot.send_message(chat_id=chat_id, text="Sesi Anda berakhir, silakan /start lagi.")
             return
@@ -109,7 +109,7 @@ async def ewallet_choice_callback_handler(update: Update, context: ContextTypes.
 
 async def show_qris_payment_bot(update: Update, context: ContextTypes.DEFAULT_TYPE, package_list: list):
     chat_id = update.effective_chat.id
-    active_user = AuthInstance.get_active_user(chat_id)
+    active_user = await AuthInstance.get_active_user_async(chat_id)
     if not active_user:
         await context.bot.send_message(chat_id=chat_id, text="Sesi login habis.")
         return
@@ -131,9 +131,9 @@ async def show_qris_payment_bot(update: Update, context: ContextTypes.DEFAULT_TY
     display_name = bundle_info['name'] if bundle_info else payment_items[0]['item_name']
     await context.bot.send_message(chat_id=chat_id, text="Membuat transaksi QRIS...")
     try:
-        qris_url = get_qris_payment_data(api_key, tokens, payment_items)
+        qris_url = await get_qris_payment_data_async(api_key, tokens, payment_items)
         if qris_url:
-            BalanceServiceInstance.deduct_balance(chat_id, 5000)
+            await BalanceServiceInstance.deduct_balance_async(chat_id, 5000, kind="transaction_fee")
             qr_image = qrcode.make(qris_url)
             buffer = io.BytesIO()
             qr_image.save(buffer, 'PNG')
@@ -147,7 +147,7 @@ async def show_qris_payment_bot(update: Update, context: ContextTypes.DEFAULT_TY
 
 async def process_ewallet_payment(update: Update, context: ContextTypes.DEFAULT_TYPE, payment_method: str, wallet_number: str = ""):
     chat_id = update.effective_chat.id if update.message else update.callback_query.effective_chat.id
-    active_user = AuthInstance.get_active_user(chat_id)
+    active_user = await AuthInstance.get_active_user_async(chat_id)
     if not active_user:
         await context.bot.send_message(chat_id=chat_id, text="Sesi login habis.")
         return
@@ -167,9 +167,9 @@ async def process_ewallet_payment(update: Update, context: ContextTypes.DEFAULT_
         payment_items.append({"item_code": item_code, "item_price": package.get("price"), "item_name": item_name, "token_confirmation": package.get("token_confirmation", "")})
     await context.bot.send_message(chat_id=chat_id, text=f"✅ Memproses pembayaran via {payment_method}...")
     try:
-        settlement_response = settlement_multipayment_v2(api_key, tokens, payment_items, wallet_number, payment_method.upper())
+        settlement_response = await settlement_multipayment_v2_async(api_key, tokens, payment_items, wallet_number, payment_method.upper())
         if settlement_response and settlement_response.get("status") == "SUCCESS":
-            BalanceServiceInstance.deduct_balance(chat_id, 5000)
+            await BalanceServiceInstance.deduct_balance_async(chat_id, 5000, kind="transaction_fee")
             if payment_method not in ["OVO", "SHOPEEPAY"]:
                 deeplink = settlement_response["data"].get("deeplink", "")
                 if deeplink:
@@ -0,0 +1,31 @@
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from app.config import user_states
+
+# USER_STATE_* -> handler pesan teks untuk state tersebut
+STATE_HANDLERS = {}
+
+def register_state_handler(*states):
+    """
+    Decorator untuk mendaftarkan handler pesan teks ke satu atau beberapa state:
+
+        @register_state_handler(USER_STATE_ENTER_TOPUP_AMOUNT)
+        async def topup_amount_handler(update, context) -> bool: ...
+
+    Handler mengembalikan True jika pesan sudah ditangani.
+    """
+    def decorator(handler):
+        for state in states:
+            if state in STATE_HANDLERS and STATE_HANDLERS[state] is not handler:
+                raise ValueError(f"State {state} sudah ditangani oleh {STATE_HANDLERS[state].__name__}")
+            STATE_HANDLERS[state] = handler
+        return handler
+    return decorator
+
+async def dispatch_state(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
+    """Meneruskan pesan teks ke handler milik state chat saat ini (satu lookup dict)."""
+    handler = STATE_HANDLERS.get(user_states.get(update.effective_chat.id))
+    if handler is None:
+        return False
+    return bool(await handler(update, context))
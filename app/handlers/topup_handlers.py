@@ -11,9 +11,15 @@ import requests
 import os
 import sqlite3
 import logging
+import asyncio
+import heapq
+import json
+import hashlib
+from datetime import datetime, timezone, timedelta
 
 from app.service.auth import AuthInstance
-from app.service.balance_service import BalanceServiceInstance
+from app.service.balance_service import BalanceServiceInstance, provider_tx_event_key
+from app.service.reff_id_store import ReffIdStoreInstance
 
 # Import client functions (assume app/client/atlantic.py provides these)
 from app.client.atlantic import (
@@ -24,10 +30,10 @@ from app.client.atlantic import (
 )
 
 from .user_handlers import show_main_menu_bot
+from .state_router import register_state_handler
 from app.config import (
     user_states,
     USER_STATE_ENTER_TOPUP_AMOUNT,
-    reff_id_to_chat_id_map,
     USER_STATE_ENTER_DEPOSIT_ID,
 )
 
@@ -41,6 +47,17 @@ if not logger.handlers:
 
 # Module-level pending deposit store (in-memory)
 global_pending_deposits = {}  # unique_code -> deposit info dict
+# Indeks nominal akhir -> unique_code. Nominal invoice yang masih hidup selalu
+# unik, jadi satu transaksi provider hanya bisa cocok dengan satu invoice.
+pending_by_amount = {}
+
+# rentang kode unik yang ditambahkan ke nominal top up
+SUFFIX_MIN = 1
+SUFFIX_MAX = 300
+
+# Min-heap (deadline_ms, unique_code). Entri invoice yang sudah selesai tidak
+# dihapus dari heap, cukup dilewati saat di-pop.
+expiry_heap = []
 
 # DB file for persistence across restarts (optional)
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
@@ -49,6 +66,33 @@ DB_PATH = os.path.join(DATA_DIR, "pending_deposits.db")
 
 # job name for periodic check
 JOB_NAME = "qris_pending_checker"
+# job run_once yang menyala tepat di deadline invoice paling awal
+EXPIRY_JOB_NAME = "qris_expiry_timer"
+
+# invoice QRIS kedaluwarsa 5 menit setelah dibuat
+PENDING_DEPOSIT_TTL_MS = 5 * 60 * 1000
+
+# Polling adaptif: cepat selagi ada invoice yang baru dibuat (user biasanya
+# langsung scan), interval dilipatgandakan tiap QRIS_POLL_BACKOFF_STEP detik
+# umur invoice termuda sampai QRIS_POLL_SLOW_INTERVAL. Tidak ada polling sama
+# sekali saat tidak ada invoice pending.
+QRIS_POLL_FAST_INTERVAL = float(os.getenv("QRIS_POLL_FAST_INTERVAL", "5"))
+QRIS_POLL_SLOW_INTERVAL = float(os.getenv("QRIS_POLL_SLOW_INTERVAL", "20"))
+QRIS_POLL_BACKOFF_STEP = float(os.getenv("QRIS_POLL_BACKOFF_STEP", "30"))
+# Anggaran panggilan ke provider (token bucket)
+QRIS_POLL_RATE_PER_MIN = float(os.getenv("QRIS_POLL_RATE_PER_MIN", "6"))
+QRIS_POLL_BURST = int(os.getenv("QRIS_POLL_BURST", "3"))
+# Tanggal di mutasi provider memakai waktu lokal provider (WIB) dan sering
+# hanya sampai menit, jadi transaksi boleh tercatat sedikit sebelum invoice dibuat.
+QRIS_PROVIDER_UTC_OFFSET = float(os.getenv("QRIS_PROVIDER_UTC_OFFSET", "7"))
+QRIS_TX_CLOCK_SKEW_MS = int(float(os.getenv("QRIS_TX_CLOCK_SKEW_SEC", "60")) * 1000)
+PROVIDER_DATE_FORMATS = (
+    "%d/%m/%Y %H:%M:%S", "%d/%m/%Y %H:%M",
+    "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M:%S",
+    "%d-%m-%Y %H:%M:%S", "%d-%m-%Y %H:%M",
+)
+# tanggal provider yang formatnya tidak dikenal; tiap format cukup diperingatkan sekali
+_unknown_provider_dates = set()
 
 # ensure data dir & db table exist
 def ensure_db():
@@ -122,15 +166,146 @@ def db_load_all_pending():
         logger.error("DB load error: %s", e)
         return {}
 
+# ----- Pending deposit store (memory + DB + amount index) -----
+# Semua perubahan pending deposit lewat helper di bawah agar
+# global_pending_deposits, tabel SQLite dan pending_by_amount tetap sama.
+
+def _index_pending(unique_code, deposit) -> bool:
+    amount = int(deposit["amount"])
+    owner = pending_by_amount.get(amount)
+    if owner is not None and owner != unique_code:
+        return False
+    pending_by_amount[amount] = unique_code
+    return True
+
+def deposit_deadline(deposit: dict) -> int:
+    return int(deposit["timestamp"]) + PENDING_DEPOSIT_TTL_MS
+
+def add_pending_deposit(deposit: dict):
+    unique_code = deposit["unique_code"]
+    if not _index_pending(unique_code, deposit):
+        # seharusnya tidak terjadi karena nominal sudah direservasi
+        logger.warning("Amount %s already used by pending %s", deposit["amount"], pending_by_amount.get(int(deposit["amount"])))
+    global_pending_deposits[unique_code] = deposit
+    heapq.heappush(expiry_heap, (deposit_deadline(deposit), unique_code))
+    db_insert_pending(unique_code, deposit["userId"], deposit["amount"], deposit["original_amount"], deposit["timestamp"], deposit["status"], deposit["qr_message_id"], deposit["deposit_id"])
+
+def remove_pending_deposit(unique_code: str):
+    deposit = global_pending_deposits.pop(unique_code, None)
+    if deposit is not None and pending_by_amount.get(int(deposit["amount"])) == unique_code:
+        del pending_by_amount[int(deposit["amount"])]
+    db_delete_pending(unique_code)
+    return deposit
+
+def find_pending_by_amount(amount: int, paid_at_ms: int = None):
+    """
+    (unique_code, deposit) untuk nominal akhir tertentu, atau None. Transaksi
+    yang lebih awal dari invoice tidak cocok: transaksi lama dengan nominal
+    yang sama tidak boleh melunasi invoice baru. Jika tanggal transaksi tidak
+    bisa dibaca (paid_at_ms None), invoice dicocokkan dengan nominal saja
+    selama masih dalam masa berlakunya.
+    """
+    unique_code = pending_by_amount.get(int(amount))
+    deposit = global_pending_deposits.get(unique_code) if unique_code else None
+    if not deposit:
+        return None
+    if paid_at_ms is None:
+        if int(time.time()*1000) > deposit_deadline(deposit):
+            return None
+        logger.warning("Transaction %s has no readable date, matching pending %s on amount only", amount, unique_code)
+        return unique_code, deposit
+    if paid_at_ms < int(deposit["timestamp"]) - QRIS_TX_CLOCK_SKEW_MS:
+        logger.debug("Transaction %s (paid_at %s) predates pending %s, skipped", amount, paid_at_ms, unique_code)
+        return None
+    return unique_code, deposit
+
+def reserve_amount(amount: int, unique_code: str):
+    """
+    Memilih kode unik sehingga amount + suffix belum dipakai invoice lain yang
+    masih pending, lalu langsung mereservasinya di indeks. Mengembalikan
+    nominal akhir, atau None jika semua suffix sedang terpakai.
+    """
+    amount = int(amount)
+    suffix = generate_random_number(SUFFIX_MIN, SUFFIX_MAX)
+    if amount + suffix in pending_by_amount:
+        free = [s for s in range(SUFFIX_MIN, SUFFIX_MAX + 1) if amount + s not in pending_by_amount]
+        if not free:
+            return None
+        suffix = random.choice(free)
+    pending_by_amount[amount + suffix] = unique_code
+    return amount + suffix
+
+def release_amount(amount: int, unique_code: str):
+    if pending_by_amount.get(int(amount)) == unique_code and unique_code not in global_pending_deposits:
+        del pending_by_amount[int(amount)]
+
+def move_reservation(old_amount: int, new_amount: int, unique_code: str) -> bool:
+    """
+    Memindahkan reservasi unique_code ke nominal lain (provider mengubah
+    nominal). False jika nominal baru sedang dipakai invoice lain; reservasi
+    lama tetap dipegang dan harus dilepas pemanggil.
+    """
+    new_amount = int(new_amount)
+    owner = pending_by_amount.get(new_amount)
+    if owner is not None and owner != unique_code:
+        return False
+    pending_by_amount[new_amount] = unique_code
+    if int(old_amount) != new_amount:
+        release_amount(old_amount, unique_code)
+    return True
+
 # load persisted pending into memory on import
 try:
-    global_pending_deposits.update(db_load_all_pending())
+    for _code, _deposit in db_load_all_pending().items():
+        global_pending_deposits[_code] = _deposit
+        heapq.heappush(expiry_heap, (deposit_deadline(_deposit), _code))
+        if not _index_pending(_code, _deposit):
+            logger.warning("Duplicate pending amount %s (%s), only %s can be matched", _deposit["amount"], _code, pending_by_amount[_deposit["amount"]])
     logger.info("Loaded %d pending deposits from DB", len(global_pending_deposits))
 except Exception as e:
     logger.error("Failed load persisted pending deposits: %s", e)
 
+class RateBudget:
+    """Token bucket: maksimal per_minute panggilan per menit, boleh burst sampai 'burst'."""
+
+    def __init__(self, per_minute: float, burst: int):
+        self.rate = per_minute / 60
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def _fill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self) -> float:
+        """Detik sampai satu token tersedia (0 jika sudah ada)."""
+        self._fill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else QRIS_POLL_SLOW_INTERVAL
+
+    def take(self) -> bool:
+        self._fill()
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+provider_budget = RateBudget(QRIS_POLL_RATE_PER_MIN, QRIS_POLL_BURST)
+
+def next_poll_interval(now_ms: int = None) -> float:
+    """Interval polling berikutnya berdasarkan umur invoice pending termuda (None jika kosong)."""
+    if not global_pending_deposits:
+        return None
+    now_ms = now_ms or int(time.time()*1000)
+    youngest_ms = max(int(d.get("timestamp", 0)) for d in global_pending_deposits.values())
+    steps = max(0, now_ms - youngest_ms) / 1000 // QRIS_POLL_BACKOFF_STEP if QRIS_POLL_BACKOFF_STEP > 0 else 0
+    return min(QRIS_POLL_SLOW_INTERVAL, QRIS_POLL_FAST_INTERVAL * 2 ** min(steps, 16))
+
 # small helpers
-def generate_random_number(a=1, b=300):
+def generate_random_number(a=SUFFIX_MIN, b=SUFFIX_MAX):
     return random.randint(a, b)
 
 def is_url(s: str) -> bool:
@@ -145,7 +320,7 @@ async def topup_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
     query = update.callback_query
     await query.answer()
     chat_id = update.effective_chat.id
-    active_user = AuthInstance.get_active_user(chat_id)
+    active_user = await AuthInstance.get_active_user_async(chat_id)
     if not active_user:
         await context.bot.send_message(chat_id=chat_id, text="Silakan login terlebih dahulu.")
         return
@@ -170,12 +345,16 @@ async def topup_action_handler(update: Update, context: ContextTypes.DEFAULT_TYP
         user_states[chat_id] = USER_STATE_ENTER_TOPUP_AMOUNT
 
 # ----- New: process deposit similar to the JS flow -----
+@register_state_handler(USER_STATE_ENTER_TOPUP_AMOUNT)
 async def topup_amount_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
     chat_id = update.effective_chat.id
     text = update.message.text
     if user_states.get(chat_id) != USER_STATE_ENTER_TOPUP_AMOUNT:
         return False
 
+    # reservasi nominal dilepas di finally, kecuali invoice sudah terdaftar
+    final_amount = None
+    registered = False
     try:
         amount = int(text.strip())
         if amount < 1000:
@@ -185,8 +364,10 @@ async def topup_amount_handler(update: Update, context: ContextTypes.DEFAULT_TYP
         # generate unique code and final amount
         userId = chat_id
         unique_code = f"user-{userId}-{int(time.time()*1000)}"
-        suffix = generate_random_number(1, 300)
-        final_amount = int(amount) + int(suffix)
+        final_amount = reserve_amount(amount, unique_code)
+        if final_amount is None:
+            await update.message.reply_text("⏳ Terlalu banyak invoice dengan nominal ini yang sedang berjalan. Silakan coba beberapa menit lagi atau gunakan nominal lain.")
+            return True
         admin_fee = final_amount - int(amount)
 
         user_states.pop(chat_id, None)
@@ -201,7 +382,21 @@ async def topup_amount_handler(update: Update, context: ContextTypes.DEFAULT_TYP
 
         # normalize returned data
         deposit_id = deposit_data.get('id') or unique_code
-        final_amount_ret = deposit_data.get('nominal') or deposit_data.get('amount') or final_amount
+        final_amount_ret = int(deposit_data.get('nominal') or deposit_data.get('amount') or final_amount)
+        if final_amount_ret != final_amount:
+            # provider mengubah nominal: reservasi dipindah ke nominal yang akan dibayar,
+            # agar poller bisa mencocokkan invoice ini
+            if not move_reservation(final_amount, final_amount_ret, unique_code):
+                logger.warning("Provider amount %s for %s is already used by pending %s, invoice cancelled", final_amount_ret, unique_code, pending_by_amount.get(final_amount_ret))
+                await msg.edit_text("❌ Gagal membuat QRIS. Silakan coba lagi.")
+                return True
+            final_amount = final_amount_ret
+            admin_fee = final_amount - int(amount)
+
+        # webhook server mencari chat_id dari reff_id ini saat callback deposit datang,
+        # dan mengkreditkan nominal yang sama dengan polling (original_amount)
+        await ReffIdStoreInstance.put_async(unique_code, userId, amount=int(amount))
+
         image_url = deposit_data.get('image_url') or deposit_data.get('image') or deposit_data.get('imageqris') or None
         qr_string = deposit_data.get('qr_string') or deposit_data.get('qr') or None
 
@@ -258,19 +453,11 @@ async def topup_amount_handler(update: Update, context: ContextTypes.DEFAULT_TYP
             "qr_message_id": getattr(qr_msg, "message_id", None),
             "deposit_id": deposit_id
         }
-        global_pending_deposits[unique_code] = pending
-        db_insert_pending(unique_code, userId, int(final_amount_ret), int(amount), pending["timestamp"], "pending", pending["qr_message_id"], deposit_id)
+        add_pending_deposit(pending)
+        registered = True
         logger.info("Created pending deposit %s for user %s amount %s", unique_code, userId, final_amount_ret)
 
-        # ensure periodic checker job is scheduled (once)
-        # schedule every 20 seconds
-        try:
-            jobs = context.job_queue.get_jobs_by_name(JOB_NAME)
-            if not jobs:
-                context.job_queue.run_repeating(check_qris_status_job, interval=20, first=20, name=JOB_NAME)
-                logger.info("Scheduled periodic QRIS checker job")
-        except Exception as e:
-            logger.error("Failed to schedule job queue: %s", e)
+        schedule_pending_deposit_jobs(context.job_queue)
 
         return True
 
@@ -279,6 +466,9 @@ async def topup_amount_handler(update: Update, context: ContextTypes.DEFAULT_TYP
     except Exception as e:
         logger.error("Error in topup_amount_handler: %s", traceback.format_exc())
         await update.message.reply_text(f"Terjadi error teknis: `{str(e)}`", parse_mode="Markdown")
+    finally:
+        if final_amount is not None and not registered:
+            release_amount(final_amount, unique_code)
 
     return True
 
@@ -291,6 +481,7 @@ async def prompt_deposit_id_handler(update: Update, context: ContextTypes.DEFAUL
     await context.bot.send_message(chat_id=chat_id, text="Silakan masukkan ID Deposit (Transaction ID) yang ingin Anda cek:")
     user_states[chat_id] = USER_STATE_ENTER_DEPOSIT_ID
 
+@register_state_handler(USER_STATE_ENTER_DEPOSIT_ID)
 async def handle_deposit_id_input(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
     chat_id = update.effective_chat.id
     if user_states.get(chat_id) != USER_STATE_ENTER_DEPOSIT_ID:
@@ -326,141 +517,269 @@ async def handle_deposit_id_input(update: Update, context: ContextTypes.DEFAULT_
     return True
 
 # ----- Periodic checker job -----
-async def check_qris_status_job(context: ContextTypes.DEFAULT_TYPE):
+def parse_provider_date(value) -> int:
+    """Tanggal transaksi provider -> epoch ms, atau None jika formatnya tidak dikenal."""
+    if isinstance(value, (int, float)) and value > 0:
+        return int(value if value > 10**12 else value * 1000)
+    text = str(value or "").strip()
+    if text.isdigit():
+        return parse_provider_date(int(text))
+    tz = timezone(timedelta(hours=QRIS_PROVIDER_UTC_OFFSET))
+    for fmt in PROVIDER_DATE_FORMATS:
+        try:
+            return int(datetime.strptime(text, fmt).replace(tzinfo=tz).timestamp() * 1000)
+        except ValueError:
+            continue
+    return None
+
+def parse_provider_transactions(raw) -> list:
+    """
+    Normalisasi respons check_deposit_status(None) menjadi list
+    {"id", "tanggal", "paid_at_ms", "kredit", "brand"}. Provider bisa mengembalikan
+    teks (format ORKUT) atau json (dict dengan 'data'/'result', atau langsung list).
+    Jika provider tidak memberi id, id adalah hash seluruh isi record (termasuk
+    field lain seperti saldo akhir/keterangan), bukan hanya tanggal|kredit|brand:
+    dua pembayaran dengan nominal sama di detik yang sama tetap beda id.
+    """
+    transactions = []
+    # If raw is str -> parse like JS
+    if isinstance(raw, str):
+        blocks = [b.strip() for b in raw.split('------------------------') if b.strip()]
+        for block in blocks:
+            kredit_match = re.search(r'Kredit\s*:\s*([\d\.]+)', block)
+            tanggal_match = re.search(r'Tanggal\s*:\s*(.+)', block)
+            brand_match = re.search(r'Brand\s*:\s*(.+)', block)
+            id_match = re.search(r'^\s*(?:ID|Trx ID|Reff ID|RRN)\s*:\s*(\S+)', block, re.I | re.M)
+            if kredit_match:
+                kredit_val = int(kredit_match.group(1).replace('.', ''))
+                transaksi = {
+                    "id": id_match.group(1) if id_match else None,
+                    "record": " ".join(block.split()),
+                    "tanggal": tanggal_match.group(1).strip() if tanggal_match else "-",
+                    "kredit": kredit_val,
+                    "brand": brand_match.group(1).strip() if brand_match else "-"
+                }
+                transactions.append(transaksi)
+    elif isinstance(raw, (dict, list)):
+        candidate_list = []
+        if isinstance(raw, list):
+            candidate_list = raw
+        elif isinstance(raw.get("data"), list):
+            candidate_list = raw["data"]
+        elif isinstance(raw.get("result"), list):
+            candidate_list = raw["result"]
+        # try to extract numeric fields
+        for it in candidate_list:
+            try:
+                kredit = None
+                for k in ("kredit","amount","nominal","jumlah","total"):
+                    if k in it:
+                        try:
+                            kredit = int(str(it[k]).replace('.',''))
+                        except Exception:
+                            kredit = None
+                            continue
+                if kredit:
+                    tx_id = next((it[k] for k in ("id", "trx_id", "transaction_id", "reff_id", "rrn") if it.get(k)), None)
+                    transactions.append({"id": tx_id, "record": json.dumps(it, sort_keys=True, default=str), "tanggal": it.get("tanggal") or it.get("date") or "", "kredit": kredit, "brand": it.get("brand") or it.get("merchant") or ""})
+            except Exception:
+                continue
+    for transaksi in transactions:
+        transaksi["paid_at_ms"] = parse_provider_date(transaksi["tanggal"])
+        if transaksi["paid_at_ms"] is None and str(transaksi["tanggal"]) not in _unknown_provider_dates:
+            if len(_unknown_provider_dates) > 1000:
+                _unknown_provider_dates.clear()
+            _unknown_provider_dates.add(str(transaksi["tanggal"]))
+            logger.warning("Unrecognised provider date %r, add its format to PROVIDER_DATE_FORMATS", transaksi["tanggal"])
+        record = transaksi.pop("record")
+        if not transaksi["id"]:
+            transaksi["id"] = "h:" + hashlib.sha1(record.encode()).hexdigest()[:20]
+    return transactions
+
+async def expire_pending_deposit(context: ContextTypes.DEFAULT_TYPE, unique_code: str, deposit: dict):
+    # cleanup dulu (sebelum await) agar poll yang berjalan bersamaan tidak melunasinya
+    remove_pending_deposit(unique_code)
+    # delete QR message if exists
+    try:
+        if deposit.get("qr_message_id"):
+            await context.bot.delete_message(chat_id=deposit["userId"], message_id=deposit["qr_message_id"])
+    except Exception:
+        pass
+    # notify user
+    try:
+        await context.bot.send_message(deposit["userId"], "❌ *Pembayaran Expired*\n\nWaktu pembayaran telah habis. Silakan klik Top Up lagi untuk mendapatkan QR baru.", parse_mode="Markdown")
+    except Exception:
+        pass
+
+def _restore_pending(job_queue, unique_code: str, deposit: dict):
+    """Mengembalikan invoice yang gagal dilunasi ke status pending (timer expiry-nya mungkin sudah terlewati)."""
+    deposit["status"] = "pending"
+    heapq.heappush(expiry_heap, (deposit_deadline(deposit), unique_code))
+    schedule_expiry_timer(job_queue)
+
+async def complete_pending_deposit(context: ContextTypes.DEFAULT_TYPE, unique_code: str, deposit: dict, matched: dict):
+    if deposit.get("status") != "pending":
+        return
+    # ditandai sebelum await pertama: expiry job dan poll berikutnya melewati invoice ini
+    deposit["status"] = "completing"
+    expected = int(deposit["amount"])
+    # success! credit balance once (webhook may have credited this reff_id already), notify, cleanup
+    try:
+        claimed, new_balance = await BalanceServiceInstance.settle_deposit_async(
+            unique_code, provider_tx_event_key(matched["id"]), deposit["userId"], deposit["original_amount"]
+        )
+    except Exception as e:
+        # biarkan tetap pending, dicoba lagi di poll berikutnya
+        logger.error("Failed to credit deposit %s: %s", unique_code, e)
+        _restore_pending(context.job_queue, unique_code, deposit)
+        return
+    if not claimed:
+        # transaksi ini sudah melunasi invoice lain; tunggu transaksi berikutnya
+        _restore_pending(context.job_queue, unique_code, deposit)
+        return
+
+    # cleanup DB, memory & index sebelum notifikasi
+    remove_pending_deposit(unique_code)
+
+    if new_balance is not None:
+        note = f"Saldo Rp {int(deposit['original_amount']):,} telah ditambahkan."
+    else:
+        note = "Saldo sudah ditambahkan sebelumnya."
+    try:
+        await context.bot.send_message(deposit["userId"], f"✅ *Pembayaran Terdeteksi*\n\nJumlah: Rp {int(expected):,}\nBrand: {matched.get('brand','-')}\nTanggal: {matched.get('tanggal','-')}\n\n{note}", parse_mode="Markdown")
+    except Exception:
+        pass
+
+    # delete QR message
+    try:
+        if deposit.get("qr_message_id"):
+            await context.bot.delete_message(chat_id=deposit["userId"], message_id=deposit["qr_message_id"])
+    except Exception:
+        pass
+
+def schedule_expiry_timer(job_queue, current_job=None):
+    """
+    Menjaga satu job run_once yang menyala di deadline invoice paling awal.
+    Job lama hanya diganti jika heap punya deadline yang lebih awal.
+    """
+    # buang entri basi di puncak heap (invoice sudah lunas/expired)
+    while expiry_heap:
+        deadline, unique_code = expiry_heap[0]
+        deposit = global_pending_deposits.get(unique_code)
+        if deposit is not None and deposit_deadline(deposit) == deadline:
+            break
+        heapq.heappop(expiry_heap)
+
+    jobs = [job for job in job_queue.get_jobs_by_name(EXPIRY_JOB_NAME) if job is not current_job]
+    if not expiry_heap:
+        for job in jobs:
+            job.schedule_removal()
+        return
+
+    deadline = expiry_heap[0][0]
+    if jobs and jobs[0].data is not None and jobs[0].data <= deadline:
+        return
+    for job in jobs:
+        job.schedule_removal()
+    when = max(0, (deadline - int(time.time()*1000)) / 1000)
+    job_queue.run_once(expire_due_deposits_job, when=when, name=EXPIRY_JOB_NAME, data=deadline)
+
+def schedule_poll(job_queue, delay: float, current_job=None):
+    """
+    Menjaga satu job run_once untuk checker. Jika sudah ada poll yang
+    dijadwalkan lebih awal, jadwal itu dipertahankan.
+    """
+    due = time.time() + delay
+    jobs = [job for job in job_queue.get_jobs_by_name(JOB_NAME) if job is not current_job]
+    if jobs and jobs[0].data is not None and jobs[0].data <= due:
+        return
+    for job in jobs:
+        job.schedule_removal()
+    job_queue.run_once(check_qris_status_job, when=delay, name=JOB_NAME, data=due)
+
+def schedule_pending_deposit_jobs(job_queue):
+    """Dipanggil saat invoice baru dibuat dan saat bot start (invoice dari DB)."""
+    try:
+        schedule_expiry_timer(job_queue)
+        # poll pertama segera setelah invoice dibuat (user butuh beberapa detik untuk scan)
+        if global_pending_deposits:
+            schedule_poll(job_queue, max(QRIS_POLL_FAST_INTERVAL, provider_budget.wait_time()))
+    except Exception as e:
+        logger.error("Failed to schedule job queue: %s", e)
+
+async def expire_due_deposits_job(context: ContextTypes.DEFAULT_TYPE):
     """
-    JobQueue callback run periodically.
-    For each pending deposit in global_pending_deposits:
-      - If older than 5 minutes -> mark expired, delete message, notify user & DB
-      - Else call check_deposit_status (which for ORKUT may return text or json) and try to find a matching transaction
-      - If match found -> process success (notify user, TODO credit balance), cleanup
+    Timer run_once: expire hanya invoice yang deadline-nya sudah lewat
+    (pop dari heap), lalu jadwalkan ulang ke deadline berikutnya.
     """
     try:
         now_ms = int(time.time()*1000)
-        # copy keys to avoid runtime dict change
-        for unique_code, deposit in list(global_pending_deposits.items()):
+        while expiry_heap and expiry_heap[0][0] <= now_ms:
+            deadline, unique_code = heapq.heappop(expiry_heap)
+            deposit = global_pending_deposits.get(unique_code)
+            # invoice yang sedang dilunasi (status "completing") tidak di-expire
+            if deposit is None or deposit_deadline(deposit) != deadline or deposit.get("status") != "pending":
+                continue
             try:
-                # skip non-pending
-                if deposit.get("status") != "pending":
-                    continue
+                await expire_pending_deposit(context, unique_code, deposit)
+            except Exception as inner_e:
+                logger.error("Error expiring pending %s: %s", unique_code, inner_e)
+    except Exception as e:
+        logger.error("expire_due_deposits_job error: %s", e)
+    finally:
+        schedule_expiry_timer(context.job_queue, current_job=context.job)
 
-                age_ms = now_ms - int(deposit.get("timestamp", now_ms))
-                # expire after 5 minutes (300000 ms)
-                if age_ms > 5 * 60 * 1000:
-                    # delete QR message if exists
-                    try:
-                        if deposit.get("qr_message_id"):
-                            await context.bot.delete_message(chat_id=deposit["userId"], message_id=deposit["qr_message_id"])
-                    except Exception:
-                        pass
-                    # notify user
-                    try:
-                        await context.bot.send_message(deposit["userId"], "❌ *Pembayaran Expired*\n\nWaktu pembayaran telah habis. Silakan klik Top Up lagi untuk mendapatkan QR baru.", parse_mode="Markdown")
-                    except Exception:
-                        pass
-                    # cleanup
-                    db_delete_pending(unique_code)
-                    del global_pending_deposits[unique_code]
-                    continue
+async def check_qris_status_job(context: ContextTypes.DEFAULT_TYPE):
+    """
+    JobQueue callback, menjadwalkan dirinya sendiri (lihat next_poll_interval).
+      - Expiry ditangani expire_due_deposits_job, bukan di sini
+      - Berhenti saat tidak ada invoice pending; invoice baru menyalakannya lagi
+      - Setiap panggilan provider memakai satu token dari provider_budget
+      - Pending deposits: fetch recent transactions from the provider ONCE
+        (check_deposit_status(None)), parse once, and look each transaction up in
+        pending_by_amount (nominal akhir tiap invoice pending selalu unik)
+      - Hanya transaksi yang terjadi setelah invoice dibuat yang dicocokkan
+      - If match found -> credit once (per reff_id dan per transaksi provider), notify user, cleanup
+    """
+    try:
+        waiting = len(global_pending_deposits)
+        if not waiting:
+            return
+        if not provider_budget.take():
+            return
 
-                # check provider for transactions (call check_deposit_status WITHOUT id to fetch recent)
-                raw = None
-                try:
-                    raw = check_deposit_status(None)
-                except Exception as e:
-                    logger.error("check_deposit_status error: %s", e)
-                    raw = None
-
-                transactions = []
-                # If raw is str -> parse like JS
-                if isinstance(raw, str):
-                    blocks = [b.strip() for b in raw.split('------------------------') if b.strip()]
-                    for block in blocks:
-                        kredit_match = re.search(r'Kredit\s*:\s*([\d\.]+)', block)
-                        tanggal_match = re.search(r'Tanggal\s*:\s*(.+)', block)
-                        brand_match = re.search(r'Brand\s*:\s*(.+)', block)
-                        if kredit_match:
-                            kredit_val = int(kredit_match.group(1).replace('.', ''))
-                            transaksi = {
-                                "tanggal": tanggal_match.group(1).strip() if tanggal_match else "-",
-                                "kredit": kredit_val,
-                                "brand": brand_match.group(1).strip() if brand_match else "-"
-                            }
-                            transactions.append(transaksi)
-                elif isinstance(raw, dict):
-                    # If dict with 'data' as list
-                    candidate_list = []
-                    if "data" in raw and isinstance(raw["data"], list):
-                        candidate_list = raw["data"]
-                    elif isinstance(raw.get("result"), list):
-                        candidate_list = raw.get("result")
-                    elif isinstance(raw, list):
-                        candidate_list = raw
-                    # try to extract numeric fields
-                    for it in candidate_list:
-                        try:
-                            kredit = None
-                            for k in ("kredit","amount","nominal","jumlah","total"):
-                                if k in it:
-                                    try:
-                                        kredit = int(str(it[k]).replace('.',''))
-                                    except Exception:
-                                        kredit = None
-                                        continue
-                            if kredit:
-                                transactions.append({"tanggal": it.get("tanggal") or it.get("date") or "", "kredit": kredit, "brand": it.get("brand") or it.get("merchant") or ""})
-                        except Exception:
-                            continue
-                else:
-                    # unknown format -> skip
-                    transactions = []
-
-                # debug
-                if transactions:
-                    logger.debug("Parsed transactions for %s: %s", unique_code, transactions)
-
-                # find a transaction matching expected amount
-                expected = int(deposit["amount"])
-                matched = None
-                for t in transactions:
-                    try:
-                        if int(t.get("kredit")) == expected:
-                            matched = t
-                            break
-                    except Exception:
-                        continue
-
-                if matched:
-                    # success! notify user, cleanup, and (TODO) credit balance
-                    try:
-                        await context.bot.send_message(deposit["userId"], f"✅ *Pembayaran Terdeteksi*\n\nJumlah: Rp {int(expected):,}\nBrand: {matched.get('brand','-')}\nTanggal: {matched.get('tanggal','-')}\n\nSaldo akan dikreditkan otomatis jika sistem mendukungnya.", parse_mode="Markdown")
-                    except Exception:
-                        pass
-
-                    # TODO: credit user's balance here, e.g.:
-                    # BalanceServiceInstance.add_balance(deposit["userId"], deposit["original_amount"])
-                    # atau panggil fungsi internal yang sesuai.
-                    # Karena struktur internal balance service tidak di-spesifikasikan, saya hanya letakkan TODO.
-
-                    # cleanup DB & memory
-                    try:
-                        db_delete_pending(unique_code)
-                    except Exception:
-                        pass
-                    try:
-                        del global_pending_deposits[unique_code]
-                    except KeyError:
-                        pass
-
-                    # delete QR message
-                    try:
-                        if deposit.get("qr_message_id"):
-                            await context.bot.delete_message(chat_id=deposit["userId"], message_id=deposit["qr_message_id"])
-                    except Exception:
-                        pass
+        # satu panggilan provider per tick, berapa pun jumlah invoice pending
+        try:
+            raw = await asyncio.to_thread(check_deposit_status, None)
+        except Exception as e:
+            logger.error("check_deposit_status error: %s", e)
+            return
 
+        transactions = parse_provider_transactions(raw)
+        if not transactions:
+            return
+        logger.debug("Parsed %d provider transactions for %d pending deposits", len(transactions), waiting)
+
+        for matched in transactions:
+            unique_code = None
+            try:
+                # find the pending deposit expecting exactly this amount, paid after it was created
+                hit = find_pending_by_amount(matched.get("kredit"), matched.get("paid_at_ms"))
+                if not hit:
+                    continue
+                unique_code, deposit = hit
+                if deposit.get("status") != "pending":
+                    continue
+                # complete_pending_deposit menghapus indeks, jadi transaksi
+                # dengan nominal sama berikutnya tidak melunasi invoice ini lagi
+                await complete_pending_deposit(context, unique_code, deposit, matched)
             except Exception as inner_e:
                 logger.error("Error processing pending %s: %s", unique_code, inner_e)
                 continue
 
     except Exception as e:
         logger.error("check_qris_status_job top-level error: %s", e)
+    finally:
+        interval = next_poll_interval()
+        if interval is not None:
+            schedule_poll(context.job_queue, max(interval, provider_budget.wait_time()), current_job=context.job)
@@ -7,12 +7,13 @@ from telegram.ext import ContextTypes
 # Impor layanan, data, dan konfigurasi
 from app.service.auth import AuthInstance
 from app.service.balance_service import BalanceServiceInstance
-from app.client.engsel import get_balance, get_otp, submit_otp
+from app.client.engsel import get_balance_async, get_otp_async, submit_otp_async
 from app.config import ADMIN_IDS, user_states, USER_STATE_ENTER_PHONE, USER_STATE_ENTER_OTP
+from .state_router import register_state_handler
 
 async def show_main_menu_bot(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    active_user = AuthInstance.get_active_user(chat_id)
+    active_user = await AuthInstance.get_active_user_async(chat_id)
     user_info = update.effective_user
     user_id = user_info.id
     username = user_info.username if user_info.username else "Tidak ada"
@@ -56,7 +57,7 @@ async def show_main_menu_bot(update: Update, context: ContextTypes.DEFAULT_TYPE)
             f"Username: `@{username}`\n\n"
         )
         try:
-            balance = get_balance(AuthInstance.api_key, active_user["tokens"]["id_token"])
+            balance = await get_balance_async(AuthInstance.api_key, active_user["tokens"]["id_token"])
             if balance:
                 remaining_balance = balance.get("remaining", "N/A")
                 expired_at = balance.get("expired_at", 0)
@@ -99,6 +100,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_states.pop(update.effective_chat.id, None)
     await show_main_menu_bot(update, context)
 
+@register_state_handler(USER_STATE_ENTER_PHONE, USER_STATE_ENTER_OTP)
 async def login_flow_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
     # Fungsi ini tidak diubah...
     chat_id = update.effective_chat.id
@@ -112,7 +114,7 @@ async def login_flow_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
         if phone_number.startswith("628") and phone_number.isdigit() and len(phone_number) >= 11:
             context.user_data["phone_number"] = phone_number
             await update.message.reply_text("⏳ Meminta pengiriman OTP...")
-            subscriber_id = get_otp(phone_number)
+            subscriber_id = await get_otp_async(phone_number)
             if subscriber_id:
                 context.user_data["subscriber_id"] = subscriber_id
                 await update.message.reply_text(f"✅ OTP telah dikirim ke nomor {phone_number}.\nSilakan masukkan 6 digit kode OTP:")
@@ -129,16 +131,16 @@ async def login_flow_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
         phone_number = context.user_data.get("phone_number")
         if otp_code.isdigit() and len(otp_code) == 6:
             await update.message.reply_text("🔐 Memverifikasi OTP...")
-            tokens = submit_otp(AuthInstance.api_key, phone_number, otp_code)
+            tokens = await submit_otp_async(AuthInstance.api_key, phone_number, otp_code)
             if tokens and "refresh_token" in tokens:
                 user_info = update.effective_user
-                AuthInstance.add_refresh_token(
+                await AuthInstance.add_refresh_token_async(
                     number=int(phone_number), 
                     refresh_token=tokens["refresh_token"],
                     chat_id=user_info.id,
                     username=user_info.username
                 )
-                AuthInstance.set_active_user(chat_id, int(phone_number))
+                await AuthInstance.set_active_user_async(chat_id, int(phone_number))
                 await update.message.reply_text("✅ Login berhasil!")
                 await start(update, context)
             else:
@@ -1,7 +1,7 @@
-from app.client.engsel import get_family
+from app.service.family_cache import FamilyCacheInstance
 from app.service.auth import AuthInstance
 
-def get_packages_by_family_data(family_code: str, is_enterprise: bool, tokens: dict):
+async def get_packages_by_family_data(family_code: str, is_enterprise: bool, tokens: dict):
     """
     Mengambil dan memformat data paket dari family code.
     Fungsi ini sekarang menerima 'tokens' secara langsung untuk mendukung multi-user.
@@ -12,7 +12,7 @@ def get_packages_by_family_data(family_code: str, is_enterprise: bool, tokens: d
         return []
 
     # Gunakan api_key dari AuthInstance dan tokens yang diberikan dari main.py
-    family_data = get_family(AuthInstance.api_key, tokens, family_code, is_enterprise)
+    family_data = await FamilyCacheInstance.get_family(AuthInstance.api_key, tokens, family_code, is_enterprise)
     
     if not family_data or "package_variants" not in family_data:
         return []
@@ -0,0 +1,160 @@
+import os
+import json
+import threading
+from app.service.db import open_db, GroupCommitWriter
+
+AUTH_DB_PATH = os.getenv("AUTH_DB_PATH", "auth.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS accounts (
+    number INTEGER PRIMARY KEY,
+    refresh_token TEXT NOT NULL,
+    chat_id INTEGER,
+    username TEXT,
+    registration_date TEXT
+);
+CREATE INDEX IF NOT EXISTS accounts_chat_id ON accounts(chat_id);
+CREATE TABLE IF NOT EXISTS sessions (
+    chat_id INTEGER PRIMARY KEY,
+    number INTEGER NOT NULL
+);
+"""
+
+UPSERT_ACCOUNT = """
+INSERT INTO accounts (number, refresh_token, chat_id, username, registration_date)
+VALUES (:number, :refresh_token, :chat_id, :username, :registration_date)
+ON CONFLICT(number) DO UPDATE SET
+    refresh_token = excluded.refresh_token,
+    chat_id = excluded.chat_id,
+    username = excluded.username,
+    registration_date = excluded.registration_date
+"""
+UPSERT_SESSION = """
+INSERT INTO sessions (chat_id, number) VALUES (?, ?)
+ON CONFLICT(chat_id) DO UPDATE SET number = excluded.number
+"""
+DELETE_SESSION = "DELETE FROM sessions WHERE chat_id = ?"
+
+ACCOUNT_FIELDS = ("number", "refresh_token", "chat_id", "username", "registration_date")
+
+class AccountStore:
+    """
+    Penyimpanan akun terdaftar dan sesi aktif di SQLite (WAL).
+
+    Semua akun juga disimpan di memori dengan indeks berdasarkan nomor dan
+    chat_id, jadi pencarian tidak perlu query. Setiap perubahan hanya menulis
+    satu baris (upsert) lewat GroupCommitWriter, dan crash di tengah
+    penulisan tidak merusak data akun lain.
+
+    Saat pertama kali dibuat, isi refresh-tokens.json (beserta journal-nya)
+    dan sessions.json dipindahkan sekali ke database.
+    """
+
+    def __init__(self, db_path: str = AUTH_DB_PATH, tokens_filepath: str = "refresh-tokens.json", sessions_filepath: str = "sessions.json"):
+        self.db_path = db_path
+        self.by_number = {}   # number -> entry
+        self.by_chat_id = {}  # chat_id -> [number, ...]
+        self._lock = threading.Lock()  # untuk koneksi baca & indeks memori
+        self.conn = open_db(db_path)
+        self.conn.executescript(SCHEMA)
+        self.writer = GroupCommitWriter(db_path)
+        self._migrate_json(tokens_filepath, sessions_filepath)
+        self.load()
+
+    def _migrate_json(self, tokens_filepath: str, sessions_filepath: str):
+        accounts = []
+        if os.path.exists(tokens_filepath):
+            accounts = self._read_json(tokens_filepath, [])
+            # Journal dari versi sebelumnya (perubahan setelah snapshot terakhir)
+            journal_path = tokens_filepath + ".journal"
+            if os.path.exists(journal_path):
+                with open(journal_path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        try: accounts.append(json.loads(line))
+                        except json.JSONDecodeError: continue
+        sessions = self._read_json(sessions_filepath, {}) if os.path.exists(sessions_filepath) else {}
+        if not accounts and not sessions:
+            return
+
+        def migrate(conn):
+            for entry in accounts:
+                if entry.get("number") is None or not entry.get("refresh_token"):
+                    continue
+                conn.execute(UPSERT_ACCOUNT, self._row(entry))
+            for chat_id_str, number in sessions.items():
+                conn.execute(UPSERT_SESSION, (int(chat_id_str), int(number)))
+
+        self.writer.execute(migrate)
+
+        for path in (tokens_filepath, tokens_filepath + ".journal", sessions_filepath):
+            if os.path.exists(path):
+                os.replace(path, path + ".migrated")
+        print(f"Migrasi ke {self.db_path}: {len({e.get('number') for e in accounts})} akun, {len(sessions)} sesi.")
+
+    @staticmethod
+    def _read_json(filepath: str, default_value):
+        with open(filepath, 'r', encoding='utf-8') as f:
+            try: return json.load(f)
+            except json.JSONDecodeError: return default_value
+
+    @staticmethod
+    def _row(entry: dict) -> dict:
+        return {field: entry.get(field) for field in ACCOUNT_FIELDS}
+
+    def load(self):
+        with self._lock:
+            rows = self.conn.execute("SELECT * FROM accounts ORDER BY rowid").fetchall()
+        for row in rows:
+            self._index(dict(row))
+
+    def _index(self, entry: dict):
+        number = entry.get("number")
+        old = self.by_number.get(number)
+        if old and old.get("chat_id") != entry.get("chat_id"):
+            numbers = self.by_chat_id.get(old.get("chat_id"), [])
+            if number in numbers: numbers.remove(number)
+        self.by_number[number] = entry
+        numbers = self.by_chat_id.setdefault(entry.get("chat_id"), [])
+        if number not in numbers: numbers.append(number)
+
+    def get(self, number: int):
+        return self.by_number.get(number)
+
+    def get_by_chat_id(self, chat_id: int) -> list:
+        return [self.by_number[n] for n in self.by_chat_id.get(chat_id, []) if n in self.by_number]
+
+    def all(self) -> list:
+        return list(self.by_number.values())
+
+    def __len__(self):
+        return len(self.by_number)
+
+    def put(self, entry: dict):
+        """Menyimpan/mengganti satu akun."""
+        row = self._row(entry)
+        self.writer.execute(lambda conn: conn.execute(UPSERT_ACCOUNT, row))
+        with self._lock:
+            self._index(entry)
+
+    async def put_async(self, entry: dict):
+        """put untuk job/handler async (tidak memblokir event loop)."""
+        row = self._row(entry)
+        await self.writer.execute_async(lambda conn: conn.execute(UPSERT_ACCOUNT, row))
+        with self._lock:
+            self._index(entry)
+
+    # --- Sesi (chat_id -> nomor aktif) ---
+
+    def load_sessions(self) -> dict:
+        with self._lock:
+            rows = self.conn.execute("SELECT chat_id, number FROM sessions").fetchall()
+        return {row["chat_id"]: row["number"] for row in rows}
+
+    def put_session(self, chat_id: int, number: int):
+        self.writer.execute(lambda conn: conn.execute(UPSERT_SESSION, (chat_id, int(number))))
+
+    async def put_session_async(self, chat_id: int, number: int):
+        await self.writer.execute_async(lambda conn: conn.execute(UPSERT_SESSION, (chat_id, int(number))))
+
+    def delete_session(self, chat_id: int):
+        self.writer.execute(lambda conn: conn.execute(DELETE_SESSION, (chat_id,)))
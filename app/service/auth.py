@@ -1,9 +1,18 @@
 import os
-import json
 import time
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
-from app.client.engsel import get_new_token
+from app.client.engsel import get_new_token, get_new_token_async
 from app.util import ensure_api_key
+from app.service.account_store import AccountStore
+
+# Sesi tersimpan dipulihkan saat chat pertama kali dipakai (lazy).
+# AUTH_EAGER_RESTORE=true memulihkan semuanya di background saat start,
+# maksimal AUTH_RESTORE_CONCURRENCY refresh token bersamaan.
+AUTH_EAGER_RESTORE = os.getenv("AUTH_EAGER_RESTORE", "false").lower() == "true"
+AUTH_RESTORE_CONCURRENCY = int(os.getenv("AUTH_RESTORE_CONCURRENCY", "8"))
 
 class Auth:
     _instance = None
@@ -16,93 +25,227 @@ class Auth:
     def __init__(self):
         if not hasattr(self, 'initialized'):
             self.api_key = ensure_api_key()
+            # Akun & sesi disimpan di SQLite (auth.db); file JSON lama dimigrasi otomatis
             self.tokens_filepath = "refresh-tokens.json"
             self.sessions_filepath = "sessions.json"
             
-            self.refresh_tokens = self._load_from_json(self.tokens_filepath, [])
+            self.accounts = AccountStore(tokens_filepath=self.tokens_filepath, sessions_filepath=self.sessions_filepath)
             self.active_users = {}
             self.impersonation_map = {} # Untuk menyimpan sesi asli admin
+            self.pending_sessions = {}  # chat_id -> number, belum di-refresh
+            # nomor -> Future hasil refresh yang sedang berjalan; dipakai bersama
+            # jalur sync dan async agar satu nomor tidak di-refresh dua kali bersamaan
+            self._refreshing = {}
+            self._refreshing_lock = threading.Lock()
             
             self._load_and_restore_sessions()
+            if AUTH_EAGER_RESTORE and self.pending_sessions:
+                threading.Thread(target=self.restore_all_sessions, daemon=True).start()
             
             self.initialized = True
             print("AuthService (Multi-User dengan Ingatan & Admin) Initialized.")
 
-    def _load_from_json(self, filepath: str, default_value):
-        if not os.path.exists(filepath):
-            with open(filepath, 'w', encoding='utf-8') as f: json.dump(default_value, f)
-            return default_value
-        with open(filepath, 'r', encoding='utf-8') as f:
-            try: return json.load(f)
-            except json.JSONDecodeError: return default_value
+    def _load_and_restore_sessions(self):
+        # Tidak ada request jaringan di sini; token di-refresh saat sesi dipakai.
+        self.pending_sessions = self.accounts.load_sessions()
+        if not self.pending_sessions: return
+        print(f"{len(self.pending_sessions)} sesi tersimpan, akan dipulihkan saat dipakai.")
 
-    def _save_to_json(self, filepath: str, data):
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2)
+    def _claim_refresh(self, number: int):
+        """(future, owner): pemanggil pertama untuk nomor ini menjadi owner dan wajib menyelesaikan future."""
+        with self._refreshing_lock:
+            future = self._refreshing.get(number)
+            if future is not None:
+                return future, False
+            future = self._refreshing[number] = Future()
+            return future, True
 
-    def _load_and_restore_sessions(self):
-        sessions = self._load_from_json(self.sessions_filepath, {})
-        if not sessions: return
-        print(f"Memulihkan {len(sessions)} sesi dari file...")
-        for chat_id_str, number in sessions.items():
-            chat_id = int(chat_id_str)
-            self.set_active_user(chat_id, number)
+    def _finish_refresh(self, number: int, future: Future, tokens):
+        with self._refreshing_lock:
+            self._refreshing.pop(number, None)
+        future.set_result(tokens)
+
+    def _refresh_tokens(self, number: int):
+        """Token baru untuk nomor ini, atau None jika gagal (error dicatat, tidak diteruskan)."""
+        number = int(number)
+        future, owner = self._claim_refresh(number)
+        if not owner: return future.result()
+        tokens = None
+        try:
+            rt_entry = self.accounts.get(number)
+            if rt_entry:
+                tokens = get_new_token(rt_entry.get("refresh_token"))
+        except Exception as e:
+            print(f"Gagal refresh token nomor {number}: {e}")
+        finally:
+            self._finish_refresh(number, future, tokens)
+        return tokens
+
+    async def _refresh_tokens_async(self, number: int):
+        """_refresh_tokens tanpa memblokir event loop; ikut menunggu refresh sync yang sedang berjalan."""
+        number = int(number)
+        future, owner = self._claim_refresh(number)
+        if not owner: return await asyncio.wrap_future(future)
+        tokens = None
+        try:
+            rt_entry = self.accounts.get(number)
+            if rt_entry:
+                tokens = await get_new_token_async(rt_entry.get("refresh_token"))
+        except Exception as e:
+            print(f"Gagal refresh token nomor {number}: {e}")
+        finally:
+            self._finish_refresh(number, future, tokens)
+        return tokens
+
+    def _restore_session(self, chat_id: int) -> bool:
+        if chat_id in self.active_users: return True
+        # Tetap di pending_sessions selama refresh berjalan; pemanggil lain ikut menunggu refresh yang sama
+        number = self.pending_sessions.get(chat_id)
+        if number is None: return False
+        tokens = self._refresh_tokens(number)
+        return self._finish_restore(chat_id, number, tokens)
+
+    async def _restore_session_async(self, chat_id: int) -> bool:
+        """Sama dengan _restore_session, tapi refresh token tanpa memblokir event loop."""
+        if chat_id in self.active_users: return True
+        number = self.pending_sessions.get(chat_id)
+        if number is None: return False
+        tokens = await self._refresh_tokens_async(number)
+        return self._finish_restore(chat_id, number, tokens)
+
+    def _finish_restore(self, chat_id: int, number: int, tokens) -> bool:
+        if chat_id in self.active_users: return True
+        if not tokens:
+            # Jika gagal, sesi tetap tersimpan dan dicoba lagi saat restart
+            self.pending_sessions.pop(chat_id, None)
+            print(f"Gagal memulihkan sesi chat_id {chat_id}.")
+            return False
+        self._activate(chat_id, number, tokens, save=False)
+        return True
+
+    def restore_all_sessions(self, max_workers: int = AUTH_RESTORE_CONCURRENCY):
+        """Refresh semua sesi yang belum dipulihkan secara paralel."""
+        pending = list(self.pending_sessions)
+        if not pending: return
+        print(f"Memulihkan {len(pending)} sesi ({max_workers} paralel)...")
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            restored = sum(executor.map(self._restore_session, pending))
+        print(f"Pemulihan sesi selesai: {restored}/{len(pending)} berhasil.")
+
+    @property
+    def refresh_tokens(self) -> list:
+        """Daftar semua akun terdaftar (kompatibel dengan format list lama)."""
+        return self.accounts.all()
 
     def add_refresh_token(self, number: int, refresh_token: str, chat_id: int, username: str):
-        number_found = False
+        self.accounts.put(self._refresh_token_entry(number, refresh_token, chat_id, username))
+
+    async def add_refresh_token_async(self, number: int, refresh_token: str, chat_id: int, username: str):
+        """add_refresh_token untuk handler async (tidak memblokir event loop)."""
+        await self.accounts.put_async(self._refresh_token_entry(number, refresh_token, chat_id, username))
+
+    def _refresh_token_entry(self, number: int, refresh_token: str, chat_id: int, username: str) -> dict:
         registration_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        for i, token_entry in enumerate(self.refresh_tokens):
-            if token_entry.get("number") == number:
-                self.refresh_tokens[i]['refresh_token'] = refresh_token
-                self.refresh_tokens[i]['chat_id'] = chat_id
-                self.refresh_tokens[i]['username'] = username if username else "N/A"
-                if 'registration_date' not in token_entry or not token_entry['registration_date']:
-                    self.refresh_tokens[i]['registration_date'] = registration_date
-                number_found = True
-                break
-        if not number_found:
-            self.refresh_tokens.append({
+        token_entry = self.accounts.get(number)
+        if token_entry:
+            token_entry = dict(token_entry)
+            token_entry['refresh_token'] = refresh_token
+            token_entry['chat_id'] = chat_id
+            token_entry['username'] = username if username else "N/A"
+            if not token_entry.get('registration_date'):
+                token_entry['registration_date'] = registration_date
+        else:
+            token_entry = {
                 "number": number, "refresh_token": refresh_token, "chat_id": chat_id,
                 "username": username if username else "N/A", "registration_date": registration_date
-            })
-        self._save_to_json(self.tokens_filepath, self.refresh_tokens)
+            }
+        return token_entry
 
-    def set_active_user(self, chat_id: int, number: int):
-        rt_entry = next((rt for rt in self.refresh_tokens if rt.get("number") == number), None)
-        if not rt_entry: return False
-        tokens = get_new_token(rt_entry.get("refresh_token"))
+    def set_active_user(self, chat_id: int, number: int, save: bool = True):
+        tokens = self._refresh_tokens(number)
+        if not tokens: return False
+        self._activate(chat_id, number, tokens, save)
+        return True
+
+    async def set_active_user_async(self, chat_id: int, number: int, save: bool = True):
+        """set_active_user untuk handler async: refresh token dan penulisan sesi tidak memblokir event loop."""
+        tokens = await self._refresh_tokens_async(number)
         if not tokens: return False
+        self._activate(chat_id, number, tokens, save=False)
+        if save:
+            await self.accounts.put_session_async(chat_id, number)
+        # refresh_token hasil rotasi (jika ada) ikut disimpan
+        await self.update_session_tokens_async(chat_id, tokens)
+        return True
+
+    def _activate(self, chat_id: int, number: int, tokens: dict, save: bool):
         self.active_users[chat_id] = {"number": int(number), "tokens": tokens, "last_refresh": int(time.time())}
-        sessions = self._load_from_json(self.sessions_filepath, {})
-        sessions[str(chat_id)] = number
-        self._save_to_json(self.sessions_filepath, sessions)
+        self.pending_sessions.pop(chat_id, None)
+        if save:
+            self.accounts.put_session(chat_id, number)
         print(f"Sesi aktif dibuat/diperbarui untuk chat_id {chat_id} dengan nomor {number}")
-        return True
 
     def get_active_user(self, chat_id: int):
         if chat_id in self.impersonation_map:
             impersonated_chat_id = self.impersonation_map[chat_id]
             return self.get_active_user(impersonated_chat_id)
         user_session = self.active_users.get(chat_id)
-        if not user_session: return None
-        if (int(time.time()) - user_session.get("last_refresh", 0)) > 300:
-            print(f"Memperbarui token untuk chat_id {chat_id}...")
-            # ... (logika refresh token)
+        if not user_session and chat_id in self.pending_sessions:
+            self._restore_session(chat_id)
+            user_session = self.active_users.get(chat_id)
+        # Token diperbarui di background oleh TokenRefresher, tidak di sini
         return user_session
 
+    async def get_active_user_async(self, chat_id: int):
+        """Versi untuk handler async: pemulihan sesi lazy tidak memblokir event loop."""
+        if chat_id in self.impersonation_map:
+            return await self.get_active_user_async(self.impersonation_map[chat_id])
+        user_session = self.active_users.get(chat_id)
+        if not user_session and chat_id in self.pending_sessions:
+            await self._restore_session_async(chat_id)
+            user_session = self.active_users.get(chat_id)
+        return user_session
+
+    def update_session_tokens(self, chat_id: int, tokens: dict) -> bool:
+        """
+        Menyimpan token hasil refresh ke sesi aktif.
+        Mengembalikan True jika refresh_token ikut berubah (langsung disimpan ke auth.db lewat AccountStore).
+        """
+        rt_entry = self._apply_session_tokens(chat_id, tokens)
+        if not rt_entry: return False
+        self.accounts.put(rt_entry)
+        return True
+
+    async def update_session_tokens_async(self, chat_id: int, tokens: dict) -> bool:
+        """update_session_tokens untuk job async (TokenRefresher)."""
+        rt_entry = self._apply_session_tokens(chat_id, tokens)
+        if not rt_entry: return False
+        await self.accounts.put_async(rt_entry)
+        return True
+
+    def _apply_session_tokens(self, chat_id: int, tokens: dict):
+        """Memperbarui sesi di memori; mengembalikan entri akun jika refresh_token perlu disimpan."""
+        session = self.active_users.get(chat_id)
+        if not session: return None
+        session["tokens"] = tokens
+        session["last_refresh"] = int(time.time())
+        new_refresh_token = tokens.get("refresh_token")
+        if not new_refresh_token: return None
+        rt_entry = self.accounts.get(session["number"])
+        if not rt_entry or rt_entry.get("refresh_token") == new_refresh_token: return None
+        return dict(rt_entry, refresh_token=new_refresh_token)
+
     def logout(self, chat_id: int):
         if chat_id in self.active_users: del self.active_users[chat_id]
-        sessions = self._load_from_json(self.sessions_filepath, {})
-        if str(chat_id) in sessions:
-            del sessions[str(chat_id)]
-            self._save_to_json(self.sessions_filepath, sessions)
+        self.pending_sessions.pop(chat_id, None)
+        self.accounts.delete_session(chat_id)
         print(f"Sesi untuk chat_id {chat_id} telah dihapus (logout).")
 
     def get_all_registered_users(self):
         return self.refresh_tokens
 
     def start_impersonation(self, admin_chat_id: int, target_user_number: int):
-        target_user_data = next((user for user in self.refresh_tokens if user.get("number") == target_user_number), None)
+        target_user_data = self.accounts.get(target_user_number)
         if not target_user_data or not target_user_data.get("chat_id"):
             return f"Error: Pengguna dengan nomor {target_user_number} tidak terdaftar."
         target_chat_id = target_user_data["chat_id"]
@@ -112,6 +255,18 @@ class Auth:
         self.impersonation_map[admin_chat_id] = target_chat_id
         return f"Anda sekarang bertindak sebagai pengguna {target_user_number}."
 
+    async def start_impersonation_async(self, admin_chat_id: int, target_user_number: int):
+        """start_impersonation untuk handler async (sesi target dibuat tanpa memblokir event loop)."""
+        target_user_data = self.accounts.get(target_user_number)
+        if not target_user_data or not target_user_data.get("chat_id"):
+            return f"Error: Pengguna dengan nomor {target_user_number} tidak terdaftar."
+        target_chat_id = target_user_data["chat_id"]
+        if not self.active_users.get(target_chat_id):
+            if not await self.set_active_user_async(target_chat_id, target_user_number):
+                return f"Gagal membuat sesi untuk pengguna {target_user_number}."
+        self.impersonation_map[admin_chat_id] = target_chat_id
+        return f"Anda sekarang bertindak sebagai pengguna {target_user_number}."
+
     def stop_impersonation(self, admin_chat_id: int):
         if admin_chat_id in self.impersonation_map:
             del self.impersonation_map[admin_chat_id]
@@ -1,10 +1,76 @@
 import json
 import os
-from typing import Dict
+import time
+import threading
+from datetime import datetime
+from typing import Dict, List
+
+from app.service.db import open_db, GroupCommitWriter
+
+LEDGER_DB_PATH = os.getenv("LEDGER_DB_PATH", "ledger.db")
+# Berapa lama event deposit yang sudah dikreditkan diingat (untuk menolak retry/duplikat)
+PROCESSED_EVENT_TTL = int(os.getenv("PROCESSED_EVENT_TTL", str(30 * 24 * 60 * 60)))
+PROCESSED_EVENT_PRUNE_INTERVAL = 60 * 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ledger (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    delta REAL NOT NULL,
+    balance_after REAL NOT NULL,
+    kind TEXT NOT NULL,
+    reference TEXT,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ledger_chat_id ON ledger(chat_id, id);
+CREATE TABLE IF NOT EXISTS balances (
+    chat_id INTEGER PRIMARY KEY,
+    balance REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS processed_events (
+    event_key TEXT PRIMARY KEY,
+    chat_id INTEGER,
+    processed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS processed_events_processed_at ON processed_events(processed_at);
+"""
+
+CREDIT_BALANCE = """
+INSERT INTO balances (chat_id, balance) VALUES (?, ?)
+ON CONFLICT(chat_id) DO UPDATE SET balance = balance + excluded.balance
+"""
+# Hanya berhasil jika saldo cukup; dicek dan dipotong dalam satu statement
+DEBIT_BALANCE = "UPDATE balances SET balance = balance - ? WHERE chat_id = ? AND balance >= ?"
+SELECT_BALANCE = "SELECT balance FROM balances WHERE chat_id = ?"
+INSERT_LEDGER = """
+INSERT INTO ledger (chat_id, delta, balance_after, kind, reference, created_at)
+VALUES (?, ?, ?, ?, ?, ?)
+"""
+# rowcount 0 = event sudah pernah diproses
+MARK_PROCESSED = "INSERT OR IGNORE INTO processed_events (event_key, chat_id, processed_at) VALUES (?, ?, ?)"
+
+def deposit_event_key(reff_id: str) -> str:
+    """Kunci processed_events untuk deposit; dipakai webhook dan polling QRIS."""
+    return f"deposit:{reff_id}"
+
+def provider_tx_event_key(tx_id: str) -> str:
+    """Kunci processed_events untuk satu transaksi di mutasi provider (polling QRIS)."""
+    return f"provider_tx:{tx_id}"
 
 class BalanceService:
+    """
+    Saldo aplikasi per chat_id.
+
+    Setiap perubahan dicatat sebagai baris baru di tabel 'ledger' (tidak pernah
+    diubah/dihapus) dan tabel 'balances' menyimpan saldo terkini. Keduanya
+    ditulis dalam satu transaksi SQLite (WAL), jadi aman dipakai bersamaan oleh
+    bot, admin, dan webhook server (walaupun beda proses).
+
+    Semua penulisan lewat GroupCommitWriter: mutasi yang datang bersamaan
+    digabung ke satu commit, dan pemanggil menunggu sampai commit selesai.
+    """
     _instance = None
-    
+
     def __new__(cls, *args, **kwargs):
         if not cls._instance:
             cls._instance = super().__new__(cls)
@@ -13,52 +79,200 @@ class BalanceService:
     def __init__(self):
         if not hasattr(self, 'initialized'):
             self.filepath = "user_balances.json"
-            self.balances: Dict[str, float] = {}
-            self._load_balances()
+            self.db_path = LEDGER_DB_PATH
+            self._lock = threading.Lock()  # untuk koneksi baca
+            self.conn = open_db(self.db_path)
+            self.conn.executescript(SCHEMA)
+            self.writer = GroupCommitWriter(self.db_path)
+            self.last_prune = 0.0
+            self._migrate_json()
             self.initialized = True
             print("BalanceService (berbasis chat_id) Initialized.")
 
-    def _load_balances(self):
-        """Memuat data saldo dari file JSON."""
-        if not os.path.exists(self.filepath):
-            self._save_balances()
-        
-        with open(self.filepath, 'r', encoding='utf-8') as f:
-            try:
-                # Kunci di JSON adalah string, jadi tidak masalah
-                self.balances = json.load(f)
-            except json.JSONDecodeError:
-                self.balances = {}
-
-    def _save_balances(self):
-        """Menyimpan data saldo ke file JSON."""
-        with open(self.filepath, 'w', encoding='utf-8') as f:
-            json.dump(self.balances, f, indent=4)
+    def _migrate_json(self):
+        """Memindahkan saldo dari user_balances.json (format lama) ke ledger, sekali saja."""
+        try:
+            with open(self.filepath, 'r', encoding='utf-8') as f:
+                try:
+                    balances: Dict[str, float] = json.load(f)
+                except json.JSONDecodeError:
+                    balances = {}
+        except FileNotFoundError:
+            return
+
+        def migrate(conn):
+            # Penanda ditulis dalam transaksi yang sama dengan kreditnya: jika proses
+            # crash sebelum file di-rename, atau beberapa proses (bot + worker
+            # webhook) start bersamaan, saldo tidak dikreditkan dua kali.
+            if not conn.execute(MARK_PROCESSED, (f"migration:{os.path.basename(self.filepath)}", None, time.time())).rowcount:
+                return False
+            for chat_id_str, amount in balances.items():
+                if amount:
+                    self._credit(conn, int(chat_id_str), float(amount), "migration", self.filepath)
+            return True
+
+        migrated = self.writer.execute(migrate)
+        try:
+            os.replace(self.filepath, self.filepath + ".migrated")
+        except FileNotFoundError:
+            pass  # sudah di-rename proses lain
+        if migrated:
+            print(f"Migrasi saldo: {len(balances)} pengguna dipindahkan ke {self.db_path}.")
+        else:
+            print(f"Migrasi saldo dari {self.filepath} sudah pernah dijalankan, dilewati.")
+
+    @staticmethod
+    def _now() -> str:
+        return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    def _credit(self, conn, chat_id: int, amount: float, kind: str, reference: str) -> float:
+        conn.execute(CREDIT_BALANCE, (chat_id, amount))
+        new_balance = conn.execute(SELECT_BALANCE, (chat_id,)).fetchone()["balance"]
+        conn.execute(INSERT_LEDGER, (chat_id, amount, new_balance, kind, reference, self._now()))
+        return new_balance
+
+    def _debit(self, conn, chat_id: int, amount: float, kind: str, reference: str):
+        """Mengembalikan saldo baru, atau None jika saldo tidak cukup."""
+        if not conn.execute(DEBIT_BALANCE, (amount, chat_id, amount)).rowcount:
+            return None
+        new_balance = conn.execute(SELECT_BALANCE, (chat_id,)).fetchone()["balance"]
+        conn.execute(INSERT_LEDGER, (chat_id, -amount, new_balance, kind, reference, self._now()))
+        return new_balance
+
+    def _credit_once(self, conn, event_key: str, chat_id: int, amount: float, kind: str, reference: str):
+        """Kredit + tanda processed dalam satu savepoint. None jika event_key sudah pernah diproses."""
+        if not conn.execute(MARK_PROCESSED, (event_key, chat_id, time.time())).rowcount:
+            return None
+        return self._credit(conn, chat_id, amount, kind, reference)
+
+    def _settle_deposit(self, conn, reff_id: str, tx_key: str, chat_id: int, amount: float):
+        if not conn.execute(MARK_PROCESSED, (tx_key, chat_id, time.time())).rowcount:
+            # transaksi ini sudah dipakai; sah hanya jika invoice ini sendiri sudah lunas
+            done = conn.execute("SELECT 1 FROM processed_events WHERE event_key = ?", (deposit_event_key(reff_id),)).fetchone()
+            return done is not None, None
+        return True, self._credit_once(conn, deposit_event_key(reff_id), chat_id, amount, "deposit", reff_id)
 
     def get_balance(self, chat_id: int) -> float:
         """Mendapatkan saldo berdasarkan chat_id. Mengembalikan 0 jika tidak ada."""
-        return self.balances.get(str(chat_id), 0.0)
+        with self._lock:
+            row = self.conn.execute(SELECT_BALANCE, (chat_id,)).fetchone()
+        return row["balance"] if row else 0.0
 
-    def add_balance(self, chat_id: int, amount: float) -> float:
+    def add_balance(self, chat_id: int, amount: float, kind: str = "topup", reference: str = None) -> float:
         """Menambah saldo untuk pengguna (untuk top up)."""
-        current_balance = self.get_balance(chat_id)
-        new_balance = current_balance + amount
-        self.balances[str(chat_id)] = new_balance
-        self._save_balances()
+        new_balance = self.writer.execute(lambda conn: self._credit(conn, chat_id, amount, kind, reference))
+        return self._log_credit(chat_id, amount, new_balance)
+
+    async def add_balance_async(self, chat_id: int, amount: float, kind: str = "topup", reference: str = None) -> float:
+        """add_balance untuk handler async (tidak memblokir event loop)."""
+        new_balance = await self.writer.execute_async(lambda conn: self._credit(conn, chat_id, amount, kind, reference))
+        return self._log_credit(chat_id, amount, new_balance)
+
+    @staticmethod
+    def _log_credit(chat_id: int, amount: float, new_balance: float) -> float:
         print(f"Saldo untuk chat_id {chat_id} ditambahkan sebesar {amount}. Saldo baru: {new_balance}")
         return new_balance
 
-    def deduct_balance(self, chat_id: int, amount: float) -> bool:
+    def credit_once(self, event_key: str, chat_id: int, amount: float, kind: str = "deposit", reference: str = None):
+        """
+        Menambah saldo untuk satu event pembayaran (mis. reff_id deposit) paling
+        banyak sekali, walaupun event yang sama datang dari webhook dan polling
+        atau dikirim ulang provider. Mengembalikan saldo baru, atau None jika
+        event sudah pernah dikreditkan. Error penulisan diteruskan ke pemanggil.
+        """
+        new_balance = self.writer.execute(lambda conn: self._credit_once(conn, event_key, chat_id, amount, kind, reference))
+        if new_balance is None:
+            print(f"Event {event_key} sudah pernah dikreditkan, dilewati.")
+        else:
+            self._log_credit(chat_id, amount, new_balance)
+        self._maybe_prune()
+        return new_balance
+
+    async def settle_deposit_async(self, reff_id: str, tx_key: str, chat_id: int, amount: float):
+        """
+        Kredit deposit dari jalur polling: transaksi provider (tx_key) dan
+        reff_id ditandai dalam satu savepoint, jadi satu transaksi provider
+        tidak pernah melunasi dua invoice. Mengembalikan (claimed, new_balance):
+        claimed False jika tx_key sudah melunasi invoice lain (tidak ada yang
+        ditulis); new_balance None jika reff_id sudah dikreditkan (mis. oleh webhook).
+        """
+        claimed, new_balance = await self.writer.execute_async(
+            lambda conn: self._settle_deposit(conn, reff_id, tx_key, chat_id, amount)
+        )
+        if not claimed:
+            print(f"Transaksi {tx_key} sudah dipakai invoice lain, {reff_id} tidak dikreditkan.")
+        elif new_balance is None:
+            print(f"Event {deposit_event_key(reff_id)} sudah pernah dikreditkan, dilewati.")
+        else:
+            self._log_credit(chat_id, amount, new_balance)
+        return claimed, new_balance
+
+    def prune_processed_events(self, max_age: int = PROCESSED_EVENT_TTL) -> int:
+        """Menghapus catatan event yang lebih tua dari max_age detik."""
+        cutoff = time.time() - max_age
+        self.last_prune = time.time()
+        return self.writer.execute(
+            # penanda migrasi tidak pernah dihapus
+            lambda conn: conn.execute(
+                "DELETE FROM processed_events WHERE processed_at < ? AND event_key NOT LIKE 'migration:%'", (cutoff,)
+            ).rowcount
+        )
+
+    def _maybe_prune(self):
+        if time.time() - self.last_prune >= PROCESSED_EVENT_PRUNE_INTERVAL:
+            self.prune_processed_events()
+
+    def deduct_balance(self, chat_id: int, amount: float, kind: str = "fee", reference: str = None) -> bool:
         """Memotong saldo pengguna (untuk biaya transaksi)."""
-        current_balance = self.get_balance(chat_id)
-        if current_balance < amount:
+        new_balance = self.writer.execute(lambda conn: self._debit(conn, chat_id, amount, kind, reference))
+        return self._log_debit(chat_id, amount, new_balance)
+
+    async def deduct_balance_async(self, chat_id: int, amount: float, kind: str = "fee", reference: str = None) -> bool:
+        """deduct_balance untuk handler async (tidak memblokir event loop)."""
+        new_balance = await self.writer.execute_async(lambda conn: self._debit(conn, chat_id, amount, kind, reference))
+        return self._log_debit(chat_id, amount, new_balance)
+
+    @staticmethod
+    def _log_debit(chat_id: int, amount: float, new_balance) -> bool:
+        if new_balance is None:
             print(f"Gagal memotong saldo chat_id {chat_id}. Saldo tidak cukup.")
             return False
-        
-        new_balance = current_balance - amount
-        self.balances[str(chat_id)] = new_balance
-        self._save_balances()
         print(f"Saldo untuk chat_id {chat_id} dipotong sebesar {amount}. Saldo baru: {new_balance}")
         return True
 
-BalanceServiceInstance = BalanceService()
\ No newline at end of file
+    def get_history(self, chat_id: int, limit: int = 20) -> List[dict]:
+        """Riwayat mutasi saldo terbaru untuk satu pengguna."""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT * FROM ledger WHERE chat_id = ? ORDER BY id DESC LIMIT ?", (chat_id, limit)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def replay(self, rebuild: bool = False) -> Dict[int, tuple]:
+        """
+        Menghitung ulang saldo dari seluruh ledger dan membandingkannya dengan
+        tabel balances. Mengembalikan {chat_id: (saldo_tersimpan, saldo_ledger)}
+        untuk yang berbeda; jika rebuild=True tabel balances disamakan dengan ledger.
+        """
+        def run(conn):
+            computed = {
+                row["chat_id"]: row["total"]
+                for row in conn.execute("SELECT chat_id, SUM(delta) AS total FROM ledger GROUP BY chat_id")
+            }
+            stored = {
+                row["chat_id"]: row["balance"]
+                for row in conn.execute("SELECT chat_id, balance FROM balances")
+            }
+            mismatches = {
+                chat_id: (stored.get(chat_id, 0.0), computed.get(chat_id, 0.0))
+                for chat_id in set(computed) | set(stored)
+                if abs(stored.get(chat_id, 0.0) - computed.get(chat_id, 0.0)) > 1e-6
+            }
+            if rebuild and mismatches:
+                conn.execute("DELETE FROM balances")
+                conn.executemany("INSERT INTO balances (chat_id, balance) VALUES (?, ?)", computed.items())
+            return mismatches
+
+        return self.writer.execute(run)
+
+BalanceServiceInstance = BalanceService()
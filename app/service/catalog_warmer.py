@@ -0,0 +1,104 @@
+import os
+import time
+from app.config import ADMIN_IDS
+from app.data.package_data import PREDEFINED_FAMILY_CODES
+from app.client.pipeline import ApiPipeline, get_families_pipelined
+from app.service.auth import AuthInstance
+from app.service.family_cache import FamilyCacheInstance
+from app.util import subscriber_segment
+
+CATALOG_WARMUP_INTERVAL = int(os.getenv("CATALOG_WARMUP_INTERVAL", "600"))
+CATALOG_WARMUP_CONCURRENCY = int(os.getenv("CATALOG_WARMUP_CONCURRENCY", "8"))
+CATALOG_BACKOFF_BASE = 30
+CATALOG_BACKOFF_MAX = 30 * 60
+
+JOB_NAME = "catalog_warmup"
+
+class CatalogWarmer:
+    """
+    Mengambil seluruh PREDEFINED_FAMILY_CODES di background (saat start dan
+    tiap CATALOG_WARMUP_INTERVAL detik) lalu menyimpannya di FamilyCache,
+    sehingga klik menu tidak perlu menunggu 3 round trip ke server.
+    """
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if not cls._instance:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        if not hasattr(self, 'initialized'):
+            # (family_code, is_enterprise) -> status per family
+            self.status = {
+                (f["family_code"], f["is_enterprise"]): {
+                    "name": f["name"],
+                    "fetched_at": None,
+                    "failures": 0,
+                    "next_attempt": 0,
+                }
+                for f in PREDEFINED_FAMILY_CODES
+            }
+            self.last_run = None
+            self.initialized = True
+
+    async def _pick_tokens(self):
+        """Memakai sesi admin jika ada, jika tidak sesi aktif mana pun."""
+        for admin_id in ADMIN_IDS:
+            session = await AuthInstance.get_active_user_async(admin_id)
+            if session:
+                return session["tokens"]
+        for session in list(AuthInstance.active_users.values()):
+            if session.get("tokens"):
+                return session["tokens"]
+        return None
+
+    async def warm_up(self):
+        tokens = await self._pick_tokens()
+        if not tokens:
+            print("Warm-up katalog dilewati: belum ada sesi aktif.")
+            return
+
+        now = time.time()
+        due = [
+            f for f in PREDEFINED_FAMILY_CODES
+            if now >= self.status[(f["family_code"], f["is_enterprise"])]["next_attempt"]
+        ]
+        if not due:
+            return
+
+        pipeline = ApiPipeline(AuthInstance.api_key, post_depth=CATALOG_WARMUP_CONCURRENCY)
+        results = await get_families_pipelined(AuthInstance.api_key, tokens, due, pipeline=pipeline)
+
+        segment = subscriber_segment(tokens)
+        finished_at = time.time()
+        ok = 0
+        for family, data in zip(due, results):
+            state = self.status[(family["family_code"], family["is_enterprise"])]
+            if data:
+                key = FamilyCacheInstance.make_key(family["family_code"], family["is_enterprise"], "NONE", segment)
+                FamilyCacheInstance.put(key, data)
+                state["fetched_at"] = finished_at
+                state["failures"] = 0
+                state["next_attempt"] = 0
+                ok += 1
+            else:
+                state["failures"] += 1
+                backoff = min(CATALOG_BACKOFF_BASE * 2 ** (state["failures"] - 1), CATALOG_BACKOFF_MAX)
+                state["next_attempt"] = finished_at + backoff
+
+        self.last_run = finished_at
+        print(f"Warm-up katalog selesai: {ok}/{len(due)} family diperbarui.")
+
+    def get_status(self) -> list:
+        """Status per family untuk panel admin."""
+        return [dict(state, family_code=key[0], is_enterprise=key[1]) for key, state in self.status.items()]
+
+CatalogWarmerInstance = CatalogWarmer()
+
+async def catalog_warmup_job(context):
+    """Callback JobQueue, dijadwalkan dari main.py."""
+    try:
+        await CatalogWarmerInstance.warm_up()
+    except Exception as e:
+        print(f"Error warm-up katalog: {e}")
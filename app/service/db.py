@@ -0,0 +1,151 @@
+import os
+import time
+import queue
+import asyncio
+import atexit
+import sqlite3
+import threading
+from concurrent.futures import Future
+
+# Durabilitas commit (PRAGMA synchronous):
+#   full   = fsync setiap commit grup (paling aman)
+#   normal = fsync saat checkpoint WAL (default SQLite untuk WAL)
+#   off    = tanpa fsync, hanya untuk pengujian
+DB_DURABILITY = os.getenv("DB_DURABILITY", "full").lower()
+# Penulisan yang datang dalam jendela ini digabung menjadi satu transaksi.
+GROUP_COMMIT_WINDOW_MS = float(os.getenv("GROUP_COMMIT_WINDOW_MS", "2"))
+GROUP_COMMIT_MAX_BATCH = int(os.getenv("GROUP_COMMIT_MAX_BATCH", "256"))
+
+_SYNCHRONOUS = {"full": "FULL", "normal": "NORMAL", "off": "OFF"}
+
+def open_db(path: str, durability: str = "normal") -> sqlite3.Connection:
+    """
+    Membuka database SQLite dalam mode WAL.
+    Koneksi dipakai bersama beberapa thread, jadi setiap pemakai wajib
+    menjaga aksesnya dengan lock sendiri.
+    """
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA synchronous={_SYNCHRONOUS.get(durability, 'NORMAL')}")
+    conn.execute("PRAGMA busy_timeout=5000")
+    return conn
+
+_writers = []
+
+class GroupCommitWriter:
+    """
+    Satu thread penulis per database. Operasi tulis dikirim sebagai fungsi
+    fn(conn) -> hasil; operasi yang datang berdekatan dijalankan dalam satu
+    transaksi sehingga banyak mutasi hanya butuh satu commit (satu fsync).
+
+    Pemanggil menunggu sampai transaksinya ter-commit, jadi hasil yang
+    diterima sudah tersimpan. Tiap operasi dibungkus SAVEPOINT: jika satu
+    gagal, hanya operasi itu yang dibatalkan.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        durability: str = DB_DURABILITY,
+        window_ms: float = GROUP_COMMIT_WINDOW_MS,
+        max_batch: int = GROUP_COMMIT_MAX_BATCH,
+    ):
+        self.conn = open_db(path, durability)
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.stats = {"batches": 0, "ops": 0}
+        self._queue = queue.Queue()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name=f"db-writer:{path}", daemon=True)
+        self._thread.start()
+        _writers.append(self)
+
+    def submit(self, fn) -> Future:
+        future = Future()
+        with self._lock:
+            if not self._closed:
+                self._queue.put((fn, future))
+                return future
+            # Setelah shutdown, tulis langsung tanpa batching
+            self._thread.join()
+            self._commit([(fn, future)])
+        return future
+
+    def execute(self, fn):
+        """Menjalankan fn(conn) dalam commit grup berikutnya dan menunggu hasilnya."""
+        return self.submit(fn).result()
+
+    async def execute_async(self, fn):
+        """
+        Seperti execute, tapi untuk handler/job async: event loop tidak
+        terblokir selama commit grup + fsync, dan tulisan dari banyak chat
+        bisa masuk commit yang sama.
+        """
+        return await asyncio.wrap_future(self.submit(fn))
+
+    def _run(self):
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._commit(batch)
+
+    def _commit(self, batch: list):
+        outcomes = []
+        try:
+            self.conn.execute("BEGIN IMMEDIATE")
+            for fn, future in batch:
+                self.conn.execute("SAVEPOINT op")
+                try:
+                    outcomes.append((future, fn(self.conn), None))
+                    self.conn.execute("RELEASE op")
+                except Exception as e:
+                    self.conn.execute("ROLLBACK TO op")
+                    self.conn.execute("RELEASE op")
+                    outcomes.append((future, None, e))
+            self.conn.execute("COMMIT")
+        except Exception as e:
+            if self.conn.in_transaction:
+                self.conn.execute("ROLLBACK")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        self.stats["batches"] += 1
+        self.stats["ops"] += len(batch)
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def close(self):
+        """Menulis semua operasi yang masih antre lalu menghentikan thread penulis."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join()
+
+def close_all_writers():
+    """Hook shutdown: flush semua GroupCommitWriter."""
+    for writer in _writers:
+        writer.close()
+
+atexit.register(close_all_writers)
@@ -0,0 +1,94 @@
+import time
+import asyncio
+from app.client.engsel import get_family_async
+from app.util import subscriber_segment
+from app.service.package_catalog import PackageCatalog, PackageCatalogInstance, FAMILY_CACHE_TTL
+
+class FamilyCache:
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if not cls._instance:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        if not hasattr(self, 'initialized'):
+            self.ttl = FAMILY_CACHE_TTL
+            # key -> {"data": dict, "fetched_at": float}
+            self.entries = {}
+            self._refreshing = {}  # key -> asyncio.Task
+            self.stats = {"hits": 0, "misses": 0, "stale_hits": 0, "refreshes": 0, "refresh_failures": 0}
+            self.initialized = True
+            print("FamilyCache Initialized.")
+
+    @staticmethod
+    def make_key(family_code: str, is_enterprise: bool, migration_type: str, segment: str) -> tuple:
+        # kunci yang sama dipakai PackageCatalog
+        return PackageCatalog.make_family_key(family_code, is_enterprise, migration_type, segment)
+
+    def put(self, key: tuple, data: dict):
+        """Menyimpan data family (dipakai juga oleh job warm-up)."""
+        self.entries[key] = {"data": data, "fetched_at": time.time()}
+        PackageCatalogInstance.index_family(key, data)
+
+    def peek(self, key: tuple):
+        """Mengembalikan entry apa adanya (tanpa refresh dan tanpa menghitung statistik)."""
+        return self.entries.get(key)
+
+    def invalidate(self, key: tuple):
+        self.entries.pop(key, None)
+        PackageCatalogInstance.remove_family(key)
+
+    async def get_family(
+        self,
+        api_key: str,
+        tokens: dict,
+        family_code: str,
+        is_enterprise: bool = False,
+        migration_type: str = "NONE"
+    ) -> dict:
+        """
+        Pengganti get_family_async dengan cache.
+        - Entry masih segar   -> langsung dikembalikan.
+        - Entry lewat TTL     -> data lama dikembalikan seketika, refresh jalan di background.
+        - Belum ada entry     -> ambil dari API lalu disimpan.
+        """
+        key = self.make_key(family_code, is_enterprise, migration_type, subscriber_segment(tokens))
+        entry = self.entries.get(key)
+
+        if entry:
+            if time.time() - entry["fetched_at"] < self.ttl:
+                self.stats["hits"] += 1
+            else:
+                self.stats["stale_hits"] += 1
+                self._schedule_refresh(key, api_key, tokens)
+            return entry["data"]
+
+        self.stats["misses"] += 1
+        data = await get_family_async(api_key, tokens, family_code, is_enterprise, migration_type)
+        if data:
+            self.put(key, data)
+        return data
+
+    def _schedule_refresh(self, key: tuple, api_key: str, tokens: dict):
+        if key in self._refreshing:
+            return
+        task = asyncio.create_task(self._refresh(key, api_key, tokens))
+        self._refreshing[key] = task
+        task.add_done_callback(lambda _: self._refreshing.pop(key, None))
+
+    async def _refresh(self, key: tuple, api_key: str, tokens: dict):
+        family_code, is_enterprise, migration_type, _ = key
+        self.stats["refreshes"] += 1
+        try:
+            data = await get_family_async(api_key, tokens, family_code, is_enterprise, migration_type)
+        except Exception as e:
+            print(f"Gagal refresh family {family_code}: {e}")
+            data = None
+        if data:
+            self.put(key, data)
+        else:
+            self.stats["refresh_failures"] += 1
+
+FamilyCacheInstance = FamilyCache()
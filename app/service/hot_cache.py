@@ -0,0 +1,116 @@
+import os
+import json
+import time
+import asyncio
+from app.client.http import get_async_client
+
+HOT_LIST_URLS = {
+    "hot": "https://me.mashu.lol/pg-hot.json",
+    "hot2": "https://me.mashu.lol/pg-hot2.json",
+}
+HOT_CACHE_FILE = os.getenv("HOT_CACHE_FILE", "hot_cache.json")
+HOT_REFRESH_INTERVAL = int(os.getenv("HOT_REFRESH_INTERVAL", "300"))
+
+JOB_NAME = "hot_list_refresh"
+
+class HotListCache:
+    """
+    Salinan lokal daftar paket HOT / HOT-2.
+
+    Handler hanya membaca salinan di memori (tidak pernah menunggu jaringan).
+    Job background melakukan revalidasi dengan ETag / If-Modified-Since,
+    dan salinan terakhir yang valid disimpan di HOT_CACHE_FILE agar tetap
+    tersedia setelah restart maupun saat server sumber sedang error.
+    """
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if not cls._instance:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        if not hasattr(self, 'initialized'):
+            self.filepath = HOT_CACHE_FILE
+            # name -> {"data": list, "etag": str, "last_modified": str, "fetched_at": float}
+            self.entries = {}
+            self._refreshing = None
+            self.load()
+            self.initialized = True
+
+    def load(self):
+        if not os.path.exists(self.filepath):
+            return
+        try:
+            with open(self.filepath, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Gagal membaca {self.filepath}: {e}")
+            self.entries = {}
+
+    def save(self, entries: dict = None):
+        tmp_path = self.filepath + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.entries if entries is None else entries, f, indent=4)
+        os.replace(tmp_path, self.filepath)
+
+    def get(self, name: str) -> list:
+        """Mengembalikan salinan terakhir; jika belum ada, refresh dijadwalkan di background."""
+        entry = self.entries.get(name)
+        if not entry:
+            self._schedule_refresh()
+            return []
+        return list(entry["data"])
+
+    def _schedule_refresh(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = loop.create_task(self.refresh_all())
+
+    async def refresh(self, name: str) -> bool:
+        """Revalidasi satu daftar. True jika data berubah."""
+        url = HOT_LIST_URLS[name]
+        entry = self.entries.get(name) or {}
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+        try:
+            response = await get_async_client().get(url, headers=headers, timeout=30)
+            if response.status_code == 304 and entry:
+                entry["fetched_at"] = time.time()
+                return False
+            response.raise_for_status()
+            data = response.json()
+            if not isinstance(data, list):
+                raise ValueError("format daftar paket tidak valid")
+        except Exception as e:
+            print(f"Gagal memperbarui daftar {name}, memakai salinan terakhir: {e}")
+            return False
+
+        self.entries[name] = {
+            "data": data,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "fetched_at": time.time(),
+        }
+        return True
+
+    async def refresh_all(self):
+        changed = await asyncio.gather(*(self.refresh(name) for name in HOT_LIST_URLS))
+        if any(changed):
+            try:
+                await asyncio.to_thread(self.save, dict(self.entries))
+            except OSError as e:
+                print(f"Gagal menyimpan {self.filepath}: {e}")
+
+HotListCacheInstance = HotListCache()
+
+async def hot_refresh_job(context):
+    """Callback JobQueue, dijadwalkan dari main.py."""
+    await HotListCacheInstance.refresh_all()
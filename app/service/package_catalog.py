@@ -0,0 +1,178 @@
+import os
+import re
+import time
+from typing import List, Union
+from app.util import decode_jwt_claims
+
+# Data family (daftar variant & option) jarang berubah, jadi disimpan sementara.
+FAMILY_CACHE_TTL = int(os.getenv("FAMILY_CACHE_TTL", "300"))
+# token_confirmation dari options/detail hanya berlaku sebentar.
+PACKAGE_DETAIL_TTL = int(os.getenv("PACKAGE_DETAIL_TTL", "120"))
+
+def normalize_name(name: str) -> str:
+    """Nama paket dinormalisasi agar pencarian tidak peka huruf besar/spasi/simbol."""
+    return re.sub(r"[^a-z0-9]+", " ", (name or "").lower()).strip()
+
+class PackageCatalog:
+    """
+    Indeks in-memory untuk semua option paket yang pernah dimuat dari family.
+
+    Isi family bisa berbeda per enterprise, migration_type dan segmen
+    pelanggan, jadi setiap family diindeks dengan kunci yang sama dengan
+    FamilyCache: (family_code, is_enterprise, migration_type, segment).
+    Option bisa dicari dalam O(1) lewat:
+    - kode option                   -> get_by_code
+    - (family_key, variant, order)  -> get_by_position  (format bookmark / paket HOT)
+    - nama ternormalisasi           -> find_by_name
+
+    Diisi otomatis oleh FamilyCache.put dan dihapus bersama entry FamilyCache.
+    Pemanggil yang tidak lewat FamilyCache memberi max_age agar family yang
+    lewat FAMILY_CACHE_TTL tidak dipakai lagi.
+    """
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if not cls._instance:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        if not hasattr(self, 'initialized'):
+            self.by_code = {}        # (package_option_code,) + family_key -> option
+            self.by_position = {}    # family_key + (variant_name, order) -> kunci option
+            self.by_name = {}        # normalized name -> set(kunci option)
+            self.families = {}       # family_key -> {"codes": set(kunci option), "indexed_at": float}
+            self.initialized = True
+
+    @staticmethod
+    def make_family_key(family_code: str, is_enterprise: bool, migration_type: str, segment: str) -> tuple:
+        return (family_code, bool(is_enterprise), migration_type, segment)
+
+    def index_family(self, family_key: tuple, family_data: dict):
+        """Mengganti seluruh option milik family_key dengan isi family_data."""
+        if not family_data or "package_variants" not in family_data:
+            return
+        family_code, is_enterprise, migration_type, segment = family_key
+        self.remove_family(family_key)
+
+        family_name = family_data.get("package_family", {}).get("name", "")
+        keys = set()
+        for variant in family_data.get("package_variants", []):
+            variant_name = variant.get("name")
+            for option in variant.get("package_options", []):
+                code = option.get("package_option_code")
+                if not code:
+                    continue
+                key = (code,) + family_key
+                entry = dict(option)
+                entry.update({
+                    "family_code": family_code,
+                    "family_name": family_name,
+                    "is_enterprise": is_enterprise,
+                    "migration_type": migration_type,
+                    "segment": segment,
+                    "variant_name": variant_name,
+                    "package_variant_code": variant.get("package_variant_code"),
+                })
+                self.by_code[key] = entry
+                self.by_position[family_key + (variant_name, option.get("order"))] = key
+                self.by_name.setdefault(normalize_name(option.get("name")), set()).add(key)
+                keys.add(key)
+        self.families[family_key] = {"codes": keys, "indexed_at": time.time()}
+
+    def remove_family(self, family_key: tuple):
+        family = self.families.pop(family_key, None)
+        if not family:
+            return
+        for key in family["codes"]:
+            entry = self.by_code.pop(key, None)
+            if not entry:
+                continue
+            position = family_key + (entry["variant_name"], entry.get("order"))
+            if self.by_position.get(position) == key:
+                del self.by_position[position]
+            name_key = normalize_name(entry.get("name"))
+            names = self.by_name.get(name_key)
+            if names:
+                names.discard(key)
+                if not names:
+                    del self.by_name[name_key]
+
+    def has_family(self, family_key: tuple, max_age: float = None) -> bool:
+        family = self.families.get(family_key)
+        if not family:
+            return False
+        return max_age is None or time.time() - family["indexed_at"] < max_age
+
+    def get_by_code(self, package_option_code: str, family_key: tuple, max_age: float = None) -> Union[dict, None]:
+        if not self.has_family(family_key, max_age):
+            return None
+        return self.by_code.get((package_option_code,) + family_key)
+
+    def get_by_position(self, family_key: tuple, variant_name: str, order: int, max_age: float = None) -> Union[dict, None]:
+        if not self.has_family(family_key, max_age):
+            return None
+        key = self.by_position.get(family_key + (variant_name, order))
+        return self.by_code.get(key) if key else None
+
+    def find_by_name(self, name: str, segment: str = None) -> List[dict]:
+        keys = self.by_name.get(normalize_name(name), ())
+        entries = [self.by_code[key] for key in keys if key in self.by_code]
+        return [e for e in entries if segment is None or e["segment"] == segment]
+
+PackageCatalogInstance = PackageCatalog()
+
+class PackageDetailCache:
+    """
+    Cache singkat untuk respons options/detail per pengguna.
+    Umurnya dibatasi PACKAGE_DETAIL_TTL karena token_confirmation di dalamnya
+    cepat kedaluwarsa; entry dihapus setelah dipakai untuk pembayaran.
+    """
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if not cls._instance:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        if not hasattr(self, 'initialized'):
+            self.ttl = PACKAGE_DETAIL_TTL
+            self.entries = {}  # key -> {"data": dict, "fetched_at": float}
+            self.initialized = True
+
+    @staticmethod
+    def make_key(tokens: dict, package_option_code: str, is_enterprise: bool) -> tuple:
+        id_token = tokens.get("id_token") or ""
+        owner = decode_jwt_claims(id_token).get("sub") or id_token
+        return (owner, package_option_code, bool(is_enterprise))
+
+    def get(self, key: tuple) -> Union[dict, None]:
+        entry = self.entries.get(key)
+        if not entry:
+            return None
+        if time.time() - entry["fetched_at"] >= self.ttl:
+            del self.entries[key]
+            return None
+        return entry["data"]
+
+    def put(self, key: tuple, data: dict):
+        self.entries[key] = {"data": data, "fetched_at": time.time()}
+        if len(self.entries) > 1000:
+            self.purge_expired()
+
+    def discard(self, key: tuple):
+        self.entries.pop(key, None)
+
+    def discard_items(self, tokens: dict, items: list):
+        """Dipanggil setelah settlement: token_confirmation di detail item-item ini sudah terpakai."""
+        for item in items:
+            for is_enterprise in (False, True):
+                self.discard(self.make_key(tokens, item["item_code"], is_enterprise))
+
+    def purge_expired(self):
+        now = time.time()
+        for key in [k for k, e in self.entries.items() if now - e["fetched_at"] >= self.ttl]:
+            del self.entries[key]
+
+PackageDetailCacheInstance = PackageDetailCache()
@@ -0,0 +1,144 @@
+import os
+import time
+import sqlite3
+import threading
+from app.service.db import open_db, GroupCommitWriter
+from app.service.balance_service import LEDGER_DB_PATH
+
+# Tabel reff_id ikut di ledger.db (default) agar bot dan webhook server
+# (beda proses / beda worker Gunicorn) melihat data yang sama.
+REFF_ID_DB_PATH = os.getenv("REFF_ID_DB_PATH", LEDGER_DB_PATH)
+# Callback deposit bisa datang terlambat, jadi mapping disimpan lebih lama dari umur QR
+REFF_ID_TTL = int(os.getenv("REFF_ID_TTL", str(24 * 60 * 60)))
+REFF_ID_PRUNE_INTERVAL = 10 * 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reff_ids (
+    reff_id TEXT PRIMARY KEY,
+    chat_id INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    amount REAL
+);
+CREATE INDEX IF NOT EXISTS reff_ids_expires_at ON reff_ids(expires_at);
+"""
+
+UPSERT_REFF_ID = """
+INSERT INTO reff_ids (reff_id, chat_id, expires_at, amount) VALUES (?, ?, ?, ?)
+ON CONFLICT(reff_id) DO UPDATE SET chat_id = excluded.chat_id, expires_at = excluded.expires_at, amount = excluded.amount
+"""
+SELECT_REFF_ID = "SELECT chat_id, amount FROM reff_ids WHERE reff_id = ? AND expires_at > ?"
+
+class ReffIdStore:
+    """
+    reff_id deposit -> chat_id, disimpan di SQLite (WAL) dan dipakai bersama
+    oleh bot (menulis saat invoice dibuat) dan webhook server (membaca saat
+    callback datang). Bisa dipakai seperti dict: store[reff_id] = chat_id,
+    reff_id in store, store.get(...), store.pop(...).
+
+    Nominal yang dikreditkan untuk invoice ikut disimpan (get_entry), jadi
+    webhook dan polling QRIS selalu menambah saldo dengan jumlah yang sama.
+
+    Entri yang lewat REFF_ID_TTL dianggap tidak ada dan dihapus berkala.
+    """
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if not cls._instance:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        if not hasattr(self, 'initialized'):
+            self.db_path = REFF_ID_DB_PATH
+            self.ttl = REFF_ID_TTL
+            self._lock = threading.Lock()  # untuk koneksi baca
+            self.conn = open_db(self.db_path)
+            self.conn.executescript(SCHEMA)
+            self._add_amount_column()
+            self.writer = GroupCommitWriter(self.db_path)
+            self.last_prune = 0.0
+            self.initialized = True
+
+    def _add_amount_column(self):
+        """Tabel dari versi lama belum punya kolom amount."""
+        columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(reff_ids)")}
+        if "amount" not in columns:
+            try:
+                self.conn.execute("ALTER TABLE reff_ids ADD COLUMN amount REAL")
+            except sqlite3.OperationalError:
+                pass  # sudah ditambahkan proses lain
+
+    def put(self, reff_id: str, chat_id: int, ttl: int = None, amount: float = None):
+        expires_at = time.time() + (ttl or self.ttl)
+        self.writer.execute(lambda conn: conn.execute(UPSERT_REFF_ID, (reff_id, int(chat_id), expires_at, amount)))
+        self._maybe_prune()
+
+    async def put_async(self, reff_id: str, chat_id: int, ttl: int = None, amount: float = None):
+        """put untuk handler async (tidak memblokir event loop)."""
+        expires_at = time.time() + (ttl or self.ttl)
+        await self.writer.execute_async(lambda conn: conn.execute(UPSERT_REFF_ID, (reff_id, int(chat_id), expires_at, amount)))
+        if self._prune_due():
+            await self.writer.execute_async(self._prune)
+
+    def get(self, reff_id: str, default=None):
+        entry = self.get_entry(reff_id)
+        return entry[0] if entry else default
+
+    def get_entry(self, reff_id: str):
+        """(chat_id, amount) untuk reff_id, atau None. amount None untuk entri lama."""
+        with self._lock:
+            row = self.conn.execute(SELECT_REFF_ID, (reff_id, time.time())).fetchone()
+        return (row["chat_id"], row["amount"]) if row else None
+
+    def pop(self, reff_id: str, default=None):
+        def run(conn):
+            row = conn.execute(SELECT_REFF_ID, (reff_id, time.time())).fetchone()
+            conn.execute("DELETE FROM reff_ids WHERE reff_id = ?", (reff_id,))
+            return row["chat_id"] if row else None
+        chat_id = self.writer.execute(run)
+        return default if chat_id is None else chat_id
+
+    def discard(self, reff_id: str):
+        """Menghapus reff_id tanpa membacanya dulu (webhook, setelah deposit dikreditkan)."""
+        self.writer.execute(lambda conn: conn.execute("DELETE FROM reff_ids WHERE reff_id = ?", (reff_id,)))
+
+    def prune(self) -> int:
+        """Menghapus mapping yang sudah kedaluwarsa; mengembalikan jumlah yang dihapus."""
+        self.last_prune = time.time()
+        return self.writer.execute(self._prune)
+
+    @staticmethod
+    def _prune(conn) -> int:
+        return conn.execute("DELETE FROM reff_ids WHERE expires_at <= ?", (time.time(),)).rowcount
+
+    def _prune_due(self) -> bool:
+        if time.time() - self.last_prune < REFF_ID_PRUNE_INTERVAL:
+            return False
+        self.last_prune = time.time()
+        return True
+
+    def _maybe_prune(self):
+        if self._prune_due():
+            self.writer.execute(self._prune)
+
+    def __getitem__(self, reff_id: str) -> int:
+        chat_id = self.get(reff_id)
+        if chat_id is None:
+            raise KeyError(reff_id)
+        return chat_id
+
+    def __setitem__(self, reff_id: str, chat_id: int):
+        self.put(reff_id, chat_id)
+
+    def __delitem__(self, reff_id: str):
+        if self.pop(reff_id) is None:
+            raise KeyError(reff_id)
+
+    def __contains__(self, reff_id: str) -> bool:
+        return self.get(reff_id) is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM reff_ids WHERE expires_at > ?", (time.time(),)).fetchone()[0]
+
+ReffIdStoreInstance = ReffIdStore()
@@ -0,0 +1,133 @@
+import os
+import time
+import asyncio
+from app.client.engsel import get_new_token_async
+from app.service.auth import AuthInstance
+from app.util import decode_jwt_claims
+
+# Token di-refresh TOKEN_REFRESH_MARGIN detik sebelum id_token kedaluwarsa.
+# Jadwal tiap chat digeser hingga TOKEN_REFRESH_JITTER detik agar refresh
+# tidak menumpuk di detik yang sama.
+TOKEN_REFRESH_MARGIN = int(os.getenv("TOKEN_REFRESH_MARGIN", "120"))
+TOKEN_REFRESH_JITTER = int(os.getenv("TOKEN_REFRESH_JITTER", "60"))
+TOKEN_REFRESH_CONCURRENCY = int(os.getenv("TOKEN_REFRESH_CONCURRENCY", "4"))
+TOKEN_REFRESH_TICK = int(os.getenv("TOKEN_REFRESH_TICK", "30"))
+# Dipakai jika id_token tidak punya klaim exp (sama dengan batas lama di get_active_user)
+TOKEN_DEFAULT_LIFETIME = 300
+TOKEN_BACKOFF_BASE = 30
+TOKEN_BACKOFF_MAX = 30 * 60
+
+JOB_NAME = "token_refresh"
+
+class TokenRefresher:
+    """
+    Memperbarui token semua sesi aktif di background sebelum kedaluwarsa,
+    sehingga handler tidak pernah menunggu refresh token di tengah pembelian.
+    """
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if not cls._instance:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        if not hasattr(self, 'initialized'):
+            self.failures = {}      # chat_id -> jumlah gagal berturut-turut
+            self.next_attempt = {}  # chat_id -> timestamp retry berikutnya
+            self.metrics = {
+                "refreshes": 0,
+                "failures": 0,
+                "last_latency_ms": 0.0,
+                "max_latency_ms": 0.0,
+                "total_latency_ms": 0.0,
+                "last_error": "",
+                "last_run": None,
+            }
+            self.initialized = True
+
+    @staticmethod
+    def expires_at(session: dict) -> float:
+        claims = decode_jwt_claims(session["tokens"].get("id_token") or "")
+        if claims.get("exp"):
+            return float(claims["exp"])
+        return session.get("last_refresh", 0) + TOKEN_DEFAULT_LIFETIME
+
+    def refresh_at(self, chat_id: int, session: dict) -> float:
+        jitter = chat_id % TOKEN_REFRESH_JITTER if TOKEN_REFRESH_JITTER > 0 else 0
+        scheduled = self.expires_at(session) - TOKEN_REFRESH_MARGIN - jitter
+        return max(scheduled, self.next_attempt.get(chat_id, 0))
+
+    def due_sessions(self, now: float) -> list:
+        due = [
+            (self.refresh_at(chat_id, session), chat_id)
+            for chat_id, session in list(AuthInstance.active_users.items())
+        ]
+        return [chat_id for refresh_at, chat_id in sorted(due) if refresh_at <= now]
+
+    async def refresh_due(self):
+        now = time.time()
+        self.metrics["last_run"] = now
+        due = self.due_sessions(now)
+        if not due:
+            return
+
+        semaphore = asyncio.Semaphore(TOKEN_REFRESH_CONCURRENCY)
+
+        async def bounded(chat_id):
+            async with semaphore:
+                return await self._refresh(chat_id)
+
+        results = await asyncio.gather(*(bounded(chat_id) for chat_id in due))
+        ok_count = sum(1 for ok in results if ok)
+        print(f"Refresh token: {ok_count}/{len(due)} sesi diperbarui.")
+
+    async def _refresh(self, chat_id: int) -> bool:
+        session = AuthInstance.active_users.get(chat_id)
+        if not session:
+            return False
+        refresh_token = session["tokens"].get("refresh_token")
+
+        started = time.perf_counter()
+        try:
+            tokens = await get_new_token_async(refresh_token) if refresh_token else None
+            error = "" if tokens else "refresh token tidak aktif"
+        except Exception as e:
+            tokens, error = None, str(e)
+        latency_ms = (time.perf_counter() - started) * 1000
+
+        self.metrics["last_latency_ms"] = round(latency_ms, 1)
+        self.metrics["max_latency_ms"] = round(max(self.metrics["max_latency_ms"], latency_ms), 1)
+        self.metrics["total_latency_ms"] += latency_ms
+
+        if not tokens:
+            self.metrics["failures"] += 1
+            self.metrics["last_error"] = error
+            failures = self.failures.get(chat_id, 0) + 1
+            self.failures[chat_id] = failures
+            self.next_attempt[chat_id] = time.time() + min(TOKEN_BACKOFF_BASE * 2 ** (failures - 1), TOKEN_BACKOFF_MAX)
+            print(f"Gagal refresh token chat_id {chat_id}: {error}")
+            return False
+
+        self.metrics["refreshes"] += 1
+        self.failures.pop(chat_id, None)
+        self.next_attempt.pop(chat_id, None)
+        await AuthInstance.update_session_tokens_async(chat_id, tokens)
+        return True
+
+    def get_metrics(self) -> dict:
+        metrics = dict(self.metrics)
+        attempts = metrics["refreshes"] + metrics["failures"]
+        metrics["avg_latency_ms"] = round(metrics.pop("total_latency_ms") / attempts, 1) if attempts else 0.0
+        metrics["active_sessions"] = len(AuthInstance.active_users)
+        metrics["failing_sessions"] = len(self.failures)
+        return metrics
+
+TokenRefresherInstance = TokenRefresher()
+
+async def token_refresh_job(context):
+    """Callback JobQueue, dijadwalkan dari main.py."""
+    try:
+        await TokenRefresherInstance.refresh_due()
+    except Exception as e:
+        print(f"Error refresh token: {e}")
@@ -0,0 +1,66 @@
+import os
+import asyncio
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+# Maksimal update yang diproses bersamaan (dari chat yang berbeda)
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "32"))
+# Semaphore bawaan BaseUpdateProcessor dibuat praktis tak terbatas; batas
+# sebenarnya dijaga sendiri setelah lock chat (lihat do_process_update)
+_UNBOUNDED = 2 ** 31 - 1
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """
+    Memproses update secara paralel, tapi update dari chat yang sama selalu
+    dijalankan satu per satu sesuai urutan datangnya. Dengan begitu
+    user_states dan context.user_data tetap konsisten, sementara chat lain
+    tidak perlu menunggu.
+
+    Slot concurrency (UPDATE_CONCURRENCY) baru diambil setelah lock chat
+    didapat: update yang masih menunggu giliran chat-nya tidak memakai slot,
+    jadi satu chat yang membanjiri bot tidak bisa menahan chat lain.
+    """
+
+    def __init__(self, max_concurrent_updates: int = UPDATE_CONCURRENCY):
+        if max_concurrent_updates < 1:
+            raise ValueError("`max_concurrent_updates` must be a positive integer!")
+        super().__init__(_UNBOUNDED)
+        self.concurrency_limit = max_concurrent_updates
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        self._chat_locks = {}  # chat_id -> [asyncio.Lock, jumlah update yang memakai]
+
+    @staticmethod
+    def _chat_key(update: object):
+        if isinstance(update, Update):
+            if update.effective_chat:
+                return update.effective_chat.id
+            if update.effective_user:
+                return update.effective_user.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        key = self._chat_key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+
+        entry = self._chat_locks.get(key)
+        if entry is None:
+            entry = self._chat_locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            # asyncio.Lock melayani penunggu secara FIFO, jadi urutan update per chat terjaga
+            async with entry[0]:
+                async with self._slots:
+                    await coroutine
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._chat_locks[key]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
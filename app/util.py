@@ -1,5 +1,7 @@
 import os
 import sys
+import json
+import base64
 import requests
 
 # Load API key from text file named api.key
@@ -75,3 +77,26 @@ def ensure_api_key() -> str:
 
     save_api_key(api_key)
     return api_key
+
+def decode_jwt_claims(token: str) -> dict:
+    """
+    Membaca payload JWT tanpa verifikasi tanda tangan.
+    Hanya untuk informasi lokal (exp, tipe langganan), bukan otorisasi.
+    """
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return json.loads(base64.urlsafe_b64decode(payload))
+    except Exception:
+        return {}
+
+def subscriber_segment(tokens: dict) -> str:
+    """
+    Segmen pelanggan yang menentukan isi katalog (harga/opsi bisa berbeda per segmen).
+    Diambil dari klaim id_token jika ada, default PREPAID sesuai header Ax-Substype.
+    """
+    if not tokens:
+        return "PREPAID"
+    claims = decode_jwt_claims(tokens.get("id_token") or "")
+    segment = claims.get("subscription_type") or claims.get("sub_type") or "PREPAID"
+    return str(segment).upper()
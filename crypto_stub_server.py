@@ -0,0 +1,137 @@
+# Crypto server pengganti untuk benchmark offline.
+#
+# Meniru endpoint crypto service (encryptsign, decrypt, sign-*, dan versi
+# /batch) tanpa enkripsi sungguhan: xdata hanyalah JSON yang di-base64.
+# Latensi jaringan bisa disimulasikan dengan --latency-ms.
+#
+# Menjalankan server:
+#   python crypto_stub_server.py serve --port 8870 --latency-ms 40
+#
+# Benchmark (di terminal lain):
+#   BASE_CRYPTO_URL=http://127.0.0.1:8870/api/870 CRYPTO_BATCH_ENABLED=true \
+#       python crypto_stub_server.py bench --requests 200
+#   BASE_CRYPTO_URL=http://127.0.0.1:8870/api/870 CRYPTO_BATCH_ENABLED=false \
+#       python crypto_stub_server.py bench --requests 200
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PREFIX = "/api/870"
+
+def _encryptsign(item: dict) -> dict:
+    plaintext = json.dumps(item.get("body", {})).encode("utf-8")
+    xtime = int(time.time() * 1000)
+    return {
+        "encrypted_body": {
+            "xdata": base64.b64encode(plaintext).decode("ascii"),
+            "xtime": xtime,
+        },
+        "x_signature": hashlib.sha256(plaintext + str(xtime).encode()).hexdigest(),
+    }
+
+def _decrypt(item: dict) -> dict:
+    if "xdata" not in item:
+        return {"error": "missing xdata"}
+    return {"plaintext": json.loads(base64.b64decode(item["xdata"]))}
+
+def _sign(item: dict) -> dict:
+    digest = hashlib.sha256(json.dumps(item, sort_keys=True).encode()).hexdigest()
+    return {"x_signature": digest, "ax_signature": digest}
+
+ROUTES = {
+    f"{PREFIX}/encryptsign": _encryptsign,
+    f"{PREFIX}/decrypt": _decrypt,
+    f"{PREFIX}/sign-payment": _sign,
+    f"{PREFIX}/sign-bounty": _sign,
+    f"{PREFIX}/sign-ax": _sign,
+}
+
+class StubServer(ThreadingHTTPServer):
+    # Backlog default (5) terlalu kecil untuk ratusan koneksi bersamaan.
+    request_queue_size = 512
+    daemon_threads = True
+
+class StubHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    stats = {"requests": 0, "items": 0}
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        time.sleep(self.latency)
+
+        path = self.path
+        is_batch = path.endswith("/batch")
+        handler = ROUTES.get(path[:-len("/batch")] if is_batch else path)
+        if handler is None:
+            self._reply(404, {"error": "not found"})
+            return
+
+        self.stats["requests"] += 1
+        if is_batch:
+            items = body.get("items", [])
+            self.stats["items"] += len(items)
+            self._reply(200, {"results": [handler(item) for item in items]})
+        else:
+            self.stats["items"] += 1
+            self._reply(200, handler(body))
+
+    def _reply(self, status: int, data: dict):
+        raw = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(host: str, port: int, latency_ms: float):
+    StubHandler.latency = latency_ms / 1000
+    server = StubServer((host, port), StubHandler)
+    print(f"Crypto stub berjalan di http://{host}:{port}{PREFIX} (latency {latency_ms} ms)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Total HTTP request: {StubHandler.stats['requests']}, total item: {StubHandler.stats['items']}")
+
+async def bench(total: int):
+    from app.client.encrypt import encryptsign_xdata_async, decrypt_xdata_async, CRYPTO_BATCH_ENABLED
+
+    async def one(i: int):
+        encrypted = await encryptsign_xdata_async("bench", "POST", "api/v8/bench", "token", {"i": i})
+        return await decrypt_xdata_async("bench", encrypted["encrypted_body"])
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - started
+
+    assert [r["i"] for r in results] == list(range(total))
+    mode = "batch" if CRYPTO_BATCH_ENABLED else "single"
+    print(f"[{mode}] {total} encrypt+decrypt dalam {elapsed:.3f}s ({total / elapsed:.1f} req/s)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crypto server pengganti untuk benchmark offline.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = sub.add_parser("serve")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8870)
+    serve_parser.add_argument("--latency-ms", type=float, default=0)
+
+    bench_parser = sub.add_parser("bench")
+    bench_parser.add_argument("--requests", type=int, default=200)
+
+    args = parser.parse_args()
+    if args.command == "serve":
+        serve(args.host, args.port, args.latency_ms)
+    else:
+        asyncio.run(bench(args.requests))
@@ -5,21 +5,38 @@ from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQu
 # from webhook_server import run_webhook_server
 
 from app.config import BOT_TOKEN
+from app.client.http import close_async_client
+from app.service.db import close_all_writers
+from app.service.update_processor import PerChatUpdateProcessor, UPDATE_CONCURRENCY
+from app.service.catalog_warmer import catalog_warmup_job, CATALOG_WARMUP_INTERVAL, JOB_NAME as CATALOG_JOB_NAME
+from app.service.hot_cache import hot_refresh_job, HOT_REFRESH_INTERVAL, JOB_NAME as HOT_JOB_NAME
+from app.service.token_refresher import token_refresh_job, TOKEN_REFRESH_TICK, JOB_NAME as TOKEN_JOB_NAME
 from app.handlers.user_handlers import *
 from app.handlers.package_handlers import *
 from app.handlers.payment_handlers import *
 from app.handlers.topup_handlers import *
 from app.handlers.admin_handlers import *
+from app.handlers.state_router import dispatch_state
 
 async def master_message_handler(update, context):
-    if await login_flow_handler(update, context): return
-    if await topup_amount_handler(update, context): return
-    if await handle_deposit_id_input(update, context): return
-    if await admin_input_handler(update, context): return
+    # Handler tiap state mendaftar sendiri lewat @register_state_handler
+    if await dispatch_state(update, context): return
     await show_main_menu_bot(update, context)
 
+async def on_shutdown(application):
+    await close_async_client()
+    # Pastikan semua mutasi saldo/sesi yang masih antre sudah ter-commit
+    close_all_writers()
+
 def main():
-    application = Application.builder().token(BOT_TOKEN).build()
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        # Update diproses paralel antar chat, berurutan dalam satu chat
+        .concurrent_updates(PerChatUpdateProcessor(UPDATE_CONCURRENCY))
+        .post_shutdown(on_shutdown)
+        .build()
+    )
 
     # Perintah
     application.add_handler(CommandHandler("start", start))
@@ -35,6 +52,13 @@ def main():
 
     # Message Handler
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, master_message_handler))
+
+    # Job background: refresh token sesi, daftar HOT / HOT-2 dan warm-up katalog family
+    application.job_queue.run_repeating(token_refresh_job, interval=TOKEN_REFRESH_TICK, first=5, name=TOKEN_JOB_NAME)
+    application.job_queue.run_repeating(hot_refresh_job, interval=HOT_REFRESH_INTERVAL, first=0, name=HOT_JOB_NAME)
+    application.job_queue.run_repeating(catalog_warmup_job, interval=CATALOG_WARMUP_INTERVAL, first=10, name=CATALOG_JOB_NAME)
+    # Invoice QRIS yang tersimpan di DB: timer expiry dan checker pembayaran
+    schedule_pending_deposit_jobs(application.job_queue)
     
     
     print("BOT Token ditemukan, bot utama dijalankan...")
@@ -0,0 +1,60 @@
+import asyncio
+from datetime import datetime
+
+from telegram import Chat, Message, Update
+
+from app.service.update_processor import PerChatUpdateProcessor
+
+
+def make_update(update_id: int, chat_id: int) -> Update:
+    chat = Chat(id=chat_id, type=Chat.PRIVATE)
+    return Update(update_id, message=Message(message_id=update_id, date=datetime.now(), chat=chat))
+
+
+def test_flooded_chat_does_not_block_other_chats():
+    async def scenario():
+        processor = PerChatUpdateProcessor(2)
+        release = asyncio.Event()
+        order = []
+
+        async def slow(i):
+            order.append(i)
+            await release.wait()
+
+        async def fast():
+            order.append("other")
+
+        # chat 1 mengirim lebih banyak update daripada slot yang tersedia
+        flood = [asyncio.create_task(processor.process_update(make_update(i, 1), slow(i))) for i in range(5)]
+        await asyncio.sleep(0)
+
+        await asyncio.wait_for(processor.process_update(make_update(99, 2), fast()), timeout=1)
+        assert order == [0, "other"]
+
+        release.set()
+        await asyncio.gather(*flood)
+        # update chat 1 tetap diproses berurutan
+        assert order == [0, "other", 1, 2, 3, 4]
+
+    asyncio.run(scenario())
+
+
+def test_concurrency_limit_applies_across_chats():
+    async def scenario():
+        processor = PerChatUpdateProcessor(2)
+        release = asyncio.Event()
+        running = []
+
+        async def work(i):
+            running.append(i)
+            await release.wait()
+
+        tasks = [asyncio.create_task(processor.process_update(make_update(i, i), work(i))) for i in range(4)]
+        await asyncio.sleep(0.05)
+        assert len(running) == 2
+
+        release.set()
+        await asyncio.gather(*tasks)
+        assert sorted(running) == [0, 1, 2, 3]
+
+    asyncio.run(scenario())
@@ -1,52 +1,115 @@
 from flask import Flask, request, jsonify
+from telegram import Bot
+import os
 import hashlib
 import asyncio
+import threading
 
-# Variabel global untuk menyimpan referensi
+from app.config import BOT_TOKEN
+from app.service.balance_service import BalanceServiceInstance, deposit_event_key
+from app.service.reff_id_store import ReffIdStoreInstance
+
+# Variabel global untuk menyimpan referensi (boleh diganti dari luar, mis. untuk testing)
 bot_instance = None
-balance_service_instance = None
-reff_id_map_instance = None
+balance_service_instance = BalanceServiceInstance
+reff_id_map_instance = ReffIdStoreInstance
 ATLANTIC_API_USERNAME = "Rahmarie" # PENTING: Ganti ini
 
+# Kredit saldo ditulis (commit grup, durable) sebelum callback dijawab 200;
+# hanya notifikasi Telegram yang diproses di belakang, oleh satu event loop per worker.
+WEBHOOK_NOTIFY_CONCURRENCY = int(os.getenv("WEBHOOK_NOTIFY_CONCURRENCY", "8"))
+
+_notifier_pid = None
+_notifier_lock = threading.Lock()
+_notify_loop = None
+_notify_semaphore = asyncio.Semaphore(WEBHOOK_NOTIFY_CONCURRENCY)
+_bot = None
+
 # Nama variabel diubah menjadi 'app' agar Gunicorn bisa menemukannya
 app = Flask(__name__)
 
+def start_notifier():
+    """
+    Menyalakan event loop notifikasi (sekali per proses). Dicek per PID karena
+    thread tidak ikut ter-fork jika Gunicorn dijalankan dengan --preload.
+    """
+    global _notifier_pid, _notify_loop
+    with _notifier_lock:
+        if _notifier_pid == os.getpid():
+            return
+        _notifier_pid = os.getpid()
+        # Satu event loop berumur panjang khusus untuk notifikasi Telegram
+        _notify_loop = asyncio.new_event_loop()
+        threading.Thread(target=_notify_loop.run_forever, name="webhook-notifier", daemon=True).start()
+
+def apply_credit(reff_id: str, nominal: float):
+    """
+    Mengkreditkan satu callback deposit. Saat fungsi kembali, kredit sudah
+    ter-commit. Mengembalikan (chat_id, nominal) jika saldo bertambah, None
+    jika reff_id tidak dikenal atau sudah dikreditkan. Error tulis diteruskan.
+    """
+    entry = reff_id_map_instance.get_entry(reff_id)
+    if entry is None:
+        print(f"Webhook: reff_id {reff_id} tidak dikenal, dilewati.")
+        return None
+    chat_id, amount = entry
+    if amount is None:
+        # invoice dibuat sebelum nominal disimpan bersama reff_id
+        amount = nominal
+
+    # Kunci idempotensi sama dengan jalur polling di topup_handlers; nominal juga
+    # sama (nominal top up tanpa kode unik)
+    new_balance = balance_service_instance.credit_once(deposit_event_key(reff_id), chat_id, amount, "deposit", reff_id)
+    reff_id_map_instance.discard(reff_id)
+    return (chat_id, amount) if new_balance is not None else None
+
+async def _notify(chat_id: int, nominal: float):
+    global _bot
+    success_message = f"✅ Top Up Otomatis Berhasil! Saldo sebesar *Rp {nominal:,.0f}* telah ditambahkan."
+    try:
+        if _bot is None:
+            _bot = bot_instance or Bot(BOT_TOKEN)
+        async with _notify_semaphore:
+            await _bot.send_message(chat_id=chat_id, text=success_message, parse_mode="Markdown")
+    except Exception as e:
+        print(f"Gagal kirim notifikasi top up ke {chat_id}: {e}")
+
+start_notifier()
+
 @app.route('/webhook/atlantic', methods=['POST'])
 def atlantic_webhook():
-    # ... (Isi fungsi ini tidak diubah) ...
     signature = request.headers.get('X-ATL-Signature')
     expected_signature = hashlib.md5(ATLANTIC_API_USERNAME.encode()).hexdigest()
 
     if signature != expected_signature:
         return jsonify({"status": "error", "message": "Invalid signature"}), 401
 
-    data = request.json
+    data = request.get_json(silent=True) or {}
     event = data.get('event')
     status = data.get('status')
-    
+
     if (event == 'deposit.fast' or event == 'deposit') and status == 'success':
+        deposit_data = data.get('data') or {}
+        reff_id = deposit_data.get('reff_id')
+        nominal_diterima = deposit_data.get('get_balance', deposit_data.get('nominal'))
         try:
-            deposit_data = data.get('data', {})
-            reff_id = deposit_data.get('reff_id')
-            
-            if reff_id in reff_id_map_instance:
-                chat_id = reff_id_map_instance[reff_id]
-                nominal_diterima = deposit_data.get('get_balance', deposit_data.get('nominal'))
-                
-                if nominal_diterima:
-                    balance_service_instance.add_balance(chat_id, nominal_diterima)
-                    success_message = f"✅ Top Up Otomatis Berhasil! Saldo sebesar *Rp {nominal_diterima:,}* telah ditambahkan."
-                    
-                    loop = asyncio.new_event_loop()
-                    asyncio.set_event_loop(loop)
-                    loop.run_until_complete(bot_instance.send_message(chat_id=chat_id, text=success_message, parse_mode="Markdown"))
-                    loop.close()
-
-                    del reff_id_map_instance[reff_id]
-        except Exception as e:
-            print(f"Error processing webhook: {e}")
+            nominal_diterima = float(nominal_diterima)
+        except (TypeError, ValueError):
+            nominal_diterima = None
+
+        if reff_id and nominal_diterima:
+            try:
+                credited = apply_credit(reff_id, nominal_diterima)
+            except Exception as e:
+                # Belum tersimpan: minta provider mengirim ulang
+                print(f"Error processing webhook {reff_id}: {e}")
+                return jsonify({"status": "error"}), 500
+            if credited:
+                # Notifikasi tidak ditunggu: Telegram yang lambat tidak menahan jawaban ke provider
+                start_notifier()
+                asyncio.run_coroutine_threadsafe(_notify(*credited), _notify_loop)
 
     return jsonify({"status": "received"}), 200
 
 # PENTING: Fungsi run_webhook_server dan baris app.run() DIHAPUS.
-# Gunicorn akan menangani servernya dari luar file ini.
\ No newline at end of file
+# Gunicorn akan menangani servernya dari luar file ini.